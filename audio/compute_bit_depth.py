@@ -1,5 +1,7 @@
 """
 Plots the average bit-depth of a FLAC/WAV audio file.
+With --exact, reports the bits each channel really uses, e.g. a 16-bit master padded to 24-bit.
+Given a directory, analyzes every FLAC/WAV file in it in parallel and writes a CSV/JSON summary.
 
 Dependencies:
 pip install soundfile numpy matplotlib
@@ -8,71 +10,368 @@ import soundfile as sf
 import numpy as np
 import matplotlib.pyplot as plt
 import argparse
+import csv
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+# frames read at once, rounded down to whole windows, keeps memory flat for any duration
+BLOCK_FRAMES = 1 << 20
+
+# audio files analyzed when --input is a directory
+AUDIO_EXTENSIONS = ('.flac', '.wav')
+# summary written into the directory when --summary isn't given
+SUMMARY_NAME = 'bit_depth_summary.csv'
+
+# bits of the integer PCM subtypes, soundfile reads them into the top bits of an int32
+SUBTYPE_BITS = {'PCM_S8': 8, 'PCM_U8': 8, 'PCM_16': 16, 'PCM_24': 24, 'PCM_32': 32}
+
+# a nonzero integer x below 2**24 has the float32 exponent field EXPONENT_OFFSET + bit length of x
+EXPONENT_OFFSET = 126
+
+def bit_exponents(samples):
+    """
+    Float32 exponent field of the magnitude of every integer sample, as uint8: 0 for silent samples,
+    EXPONENT_OFFSET + the number of bits used otherwise. A conversion and a shift instead of log2,
+    exact for samples scaled to 24 bits.
+    """
+    magnitudes = np.abs(samples.astype(np.float32))
+    raw = magnitudes.view(np.uint32)
+    np.right_shift(raw, 23, out=raw)
+    return raw.astype(np.uint8)
+
+def window_bit_usage(samples, window_size):
+    """
+    Min, max and average bits used by the nonzero samples of every complete window of samples,
+    computed for all windows at once on a (num_windows, window_size) view. Silent windows use 0 bits.
+    """
+    num_windows = len(samples) // window_size
+    exponents = bit_exponents(samples[:num_windows * window_size]).reshape(num_windows, window_size)
+    nonzero = np.count_nonzero(exponents, axis=1)
+    max_bits = np.maximum(exponents.max(axis=1).astype(np.int32) - EXPONENT_OFFSET, 0)
+    # bits used - 1, silent samples wrap around to the top of the uint8 range and never win the minimum
+    min_used = (exponents - np.uint8(EXPONENT_OFFSET + 1)).min(axis=1)
+    min_bits = np.where(nonzero > 0, min_used.astype(np.int32) + 1, 0)
+    avg_bits = (exponents.sum(axis=1, dtype=np.int64) - EXPONENT_OFFSET * nonzero) / np.maximum(nonzero, 1)
+    return min_bits, max_bits, avg_bits
+
+def trailing_zeros(values):
+    """
+    Number of trailing zero bits of each int32 value, 32 for 0.
+    """
+    unsigned = values.astype(np.int64) & 0xFFFFFFFF
+    lowest_bit = unsigned & -unsigned
+    # the lowest set bit is a power of two, 2**k has the frexp exponent k + 1
+    return np.where(unsigned == 0, 32, np.frexp(lowest_bit.astype(np.float64))[1] - 1)
+
+def scan_file(path, window_duration, exact=False):
+    """
+    Streams path once in blocks of whole windows and returns a dict with its samplerate, window_size,
+    subtype and the stats of every complete window:
+        min_bits, max_bits, avg_bits: bits used by the channels averaged to mono and scaled to 24 bits
+    With exact, the native integer samples are read and the ORs of each channel are added:
+        window_or, window_magnitude_or: per window and channel, see bit_padding
+        total_or, total_magnitude_or: per channel, over the whole file
+    Only one block is held in memory at a time, the per-window results are preallocated from the
+    frame count of the file.
+    """
+    info = sf.info(path)
+    window_size = int(window_duration * info.samplerate)
+    num_windows = info.frames // window_size
+    stats = {
+        'samplerate': info.samplerate,
+        'window_size': window_size,
+        'subtype': info.subtype,
+        'min_bits': np.zeros(num_windows, dtype=np.int32),
+        'max_bits': np.zeros(num_windows, dtype=np.int32),
+        'avg_bits': np.zeros(num_windows),
+    }
+    if exact:
+        stats['window_or'] = np.zeros((num_windows, info.channels), dtype=np.int32)
+        stats['window_magnitude_or'] = np.zeros((num_windows, info.channels), dtype=np.int32)
+        stats['total_or'] = np.zeros(info.channels, dtype=np.int32)
+        stats['total_magnitude_or'] = np.zeros(info.channels, dtype=np.int32)
+
+    block_size = max(1, BLOCK_FRAMES // window_size) * window_size
+    window = 0
+    for block in sf.blocks(path, blocksize=block_size, dtype='int32' if exact else 'float32', always_2d=True):
+        # the last block may end in a partial window, which is dropped
+        count = min(len(block) // window_size, num_windows - window)
+        end = count * window_size
+        if exact:
+            magnitudes = block ^ (block >> 31)
+            shape = (count, window_size, info.channels)
+            stats['window_or'][window:window + count] = np.bitwise_or.reduce(block[:end].reshape(shape), axis=1)
+            stats['window_magnitude_or'][window:window + count] = np.bitwise_or.reduce(
+                magnitudes[:end].reshape(shape), axis=1)
+            # the partial window only counts towards the totals
+            stats['total_or'] |= np.bitwise_or.reduce(block[end:], axis=0)
+            stats['total_magnitude_or'] |= np.bitwise_or.reduce(magnitudes[end:], axis=0)
+            # the same float [-1, 1] samples a float32 read returns
+            block = block[:end].astype(np.float32) * np.float32(2**-31)
+
+        # average channels to mono
+        data = block[:end].mean(axis=1)
+        # normalize data in float [-1, 1]
+        scaled_data = (data * (2**23)).astype(np.int32)
+        block_min, block_max, block_avg = window_bit_usage(scaled_data, window_size)
+        stats['min_bits'][window:window + count] = block_min
+        stats['max_bits'][window:window + count] = block_max
+        stats['avg_bits'][window:window + count] = block_avg
+        window += count
+
+    for key in ('min_bits', 'max_bits', 'avg_bits', 'window_or', 'window_magnitude_or'):
+        if key in stats:
+            stats[key] = stats[key][:window]
+    if exact:
+        stats['total_or'] |= np.bitwise_or.reduce(stats['window_or'], axis=0)
+        stats['total_magnitude_or'] |= np.bitwise_or.reduce(stats['window_magnitude_or'], axis=0)
+    return stats
+
+def bit_padding(samples_or, magnitude_or):
+    """
+    Bits used, padded LSBs and MSB headroom of int32 samples from their ORs:
+        the OR of the samples has a trailing zero for every LSB that is never used,
+        the OR of the magnitudes (x ^ x >> 31) has a leading zero for every MSB that is never used.
+    Silent samples use 0 bits.
+    """
+    padded_lsbs = trailing_zeros(samples_or)
+    used_bits = 32 - padded_lsbs
+    # bit length of the largest magnitude, below the sign bit
+    headroom_bits = 31 - np.frexp(magnitude_or.astype(np.float64))[1]
+    return used_bits, padded_lsbs, np.where(used_bits > 0, headroom_bits, 0)
+
+def padding_verdict(used_bits, headroom_bits, declared_bits):
+    """
+    Effective bit depth of a channel, in words.
+    """
+    if used_bits == 0:
+        return "silent"
+    if used_bits < declared_bits:
+        verdict = f"{used_bits}-bit padded to {declared_bits}-bit"
+    else:
+        verdict = f"{declared_bits}-bit"
+    if headroom_bits:
+        verdict += f", {headroom_bits} bit{'s' if headroom_bits > 1 else ''} of headroom"
+    return verdict
+
+def channel_padding(stats):
+    """
+    Used bits, padded LSBs, headroom and verdict of every channel of an exact scan_file result.
+    """
+    declared_bits = SUBTYPE_BITS[stats['subtype']]
+    used_bits, _, headroom_bits = bit_padding(stats['total_or'], stats['total_magnitude_or'])
+    return [{
+        'channel': channel + 1,
+        'used_bits': int(used_bits[channel]),
+        # LSBs of the declared depth that are never used
+        'padded_lsbs': max(0, declared_bits - int(used_bits[channel])) if used_bits[channel] else 0,
+        'headroom_bits': int(headroom_bits[channel]),
+        'verdict': padding_verdict(used_bits[channel], headroom_bits[channel], declared_bits),
+    } for channel in range(len(used_bits))]
+
+def envelope(times, values, columns):
+    """
+    Decimates a line of values (per row) over times to the min and max of each of about columns
+    buckets, drawn as a vertical stroke at the start of its bucket. The line looks the same at that
+    pixel width, but plotting time no longer grows with the number of windows.
+    """
+    if len(values) <= 2 * columns:
+        return times, values
+    starts = np.arange(0, len(values), -(-len(values) // columns))
+    decimated = np.empty((2 * len(starts),) + values.shape[1:], dtype=values.dtype)
+    decimated[0::2] = np.minimum.reduceat(values, starts)
+    decimated[1::2] = np.maximum.reduceat(values, starts)
+    return np.repeat(times[starts], 2), decimated
+
+def plot_columns(figure):
+    """
+    Pixel width of the figure, the number of columns worth plotting.
+    """
+    return int(figure.get_figwidth() * figure.dpi)
+
+def finish_plot(output):
+    """
+    Saves the current figure to output and closes it, or shows it if there is no output.
+    """
+    plt.grid(True)
+    plt.legend()
+    plt.tight_layout()
+    if output:
+        plt.savefig(output)
+        plt.close()
+    else:
+        plt.show()
+
+def plot_usage(stats, file_name, window_duration, output=None):
+    """
+    Plots the min/max/avg bits used per window of a scan_file result.
+    """
+    min_bits, max_bits, avg_bits = stats['min_bits'], stats['max_bits'], stats['avg_bits']
+    times = np.arange(len(avg_bits)) * stats['window_size'] / stats['samplerate']
+        
+    overall_avg = np.mean(avg_bits)
+    overall_max = np.max(max_bits)
+    
+    # plot
+    columns = plot_columns(plt.figure(figsize=(12, 6)))
+    plt.plot(*envelope(times, min_bits, columns), label="Min Bits Used", linewidth=0.5)
+    plt.plot(*envelope(times, max_bits, columns), label="Max Bits Used", linewidth=0.5)
+    plt.plot(*envelope(times, avg_bits, columns), label="Avg Bits Used", linewidth=0.5)
+    plt.xlabel("Time (s)")
+    plt.ylabel("Effective Bit Depth")
+    plt.title(f"{file_name}\n"
+		f"Effective Bit Usage Over Time (Per {window_duration:.2f}s Window)\n"
+        f"Overall Avg: {overall_avg:.2f} bits   Max: {overall_max:.0f} bits")
+    finish_plot(output)
+
+def plot_padding(stats, channels, file_name, window_duration, output=None):
+    """
+    Plots the bits used per window and channel of an exact scan_file result.
+    """
+    window_bits = bit_padding(stats['window_or'], stats['window_magnitude_or'])[0]
+    times = np.arange(len(window_bits)) * stats['window_size'] / stats['samplerate']
+    
+    # plot
+    times, window_bits = envelope(times, window_bits, plot_columns(plt.figure(figsize=(12, 6))))
+    for channel in channels:
+        plt.plot(times, window_bits[:, channel['channel'] - 1],
+                 label=f"Channel {channel['channel']}: {channel['verdict']}", linewidth=0.5)
+    plt.xlabel("Time (s)")
+    plt.ylabel("Bits Used")
+    plt.title(f"{file_name}\n"
+        f"Bits Used Per Channel Over Time (Per {window_duration:.2f}s Window)\n"
+        f"Overall Max: {max(channel['used_bits'] for channel in channels)} of {SUBTYPE_BITS[stats['subtype']]} bits")
+    finish_plot(output)
+
+def analyze_file(path, window_duration, png=False):
+    """
+    Batch worker: analyzes one file in a single pass and returns its summary. Integer PCM files
+    also get the padding verdict of every channel. With png, the bit usage plot is saved next to
+    the file as <name>_bit_depth.png.
+    """
+    exact = sf.info(path).subtype in SUBTYPE_BITS
+    stats = scan_file(path, window_duration, exact)
+    summary = {
+        'file': str(path),
+        'samplerate': stats['samplerate'],
+        'subtype': stats['subtype'],
+        'windows': len(stats['avg_bits']),
+        'avg_bits': round(float(np.mean(stats['avg_bits'])), 2) if len(stats['avg_bits']) else 0,
+        'max_bits': int(np.max(stats['max_bits'])) if len(stats['max_bits']) else 0,
+        'channels': channel_padding(stats) if exact else [],
+    }
+    if png:
+        # never open a window from a worker process
+        plt.switch_backend('Agg')
+        summary['png'] = str(Path(path).with_name(f"{Path(path).stem}_bit_depth.png"))
+        plot_usage(stats, os.path.basename(path), window_duration, summary['png'])
+    return summary
+
+def write_summary(summaries, summary_path):
+    """
+    Writes the batch summaries to summary_path, as JSON if it ends in .json and as CSV otherwise.
+    The CSV has one row per file with the verdicts of its channels joined by |.
+    """
+    if str(summary_path).lower().endswith('.json'):
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump(summaries, f, indent=2)
+        return
+    with open(summary_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['file', 'samplerate', 'subtype', 'avg_bits', 'max_bits', 'padded', 'channel_bits', 'verdicts', 'error'])
+        for summary in summaries:
+            channels = summary.get('channels', [])
+            padded = any(channel['padded_lsbs'] for channel in channels)
+            writer.writerow([summary['file'], summary.get('samplerate', ''), summary.get('subtype', ''),
+                             summary.get('avg_bits', ''), summary.get('max_bits', ''),
+                             'yes' if padded else ('no' if channels else ''),
+                             ' '.join(str(channel['used_bits']) for channel in channels),
+                             ' | '.join(channel['verdict'] for channel in channels),
+                             summary.get('error', '')])
+
+def analyze_directory(directory, window_duration, jobs, summary_path, png=False):
+    """
+    Analyzes every FLAC/WAV file in directory and its sub-folders in a pool of processes and
+    writes the summary. Files that fail to decode are listed with their error.
+    """
+    files = sorted(path for path in Path(directory).rglob('*') if path.suffix.lower() in AUDIO_EXTENSIONS)
+    if not files:
+        print(f"No FLAC/WAV files found in {directory}")
+        return
+    summaries = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(analyze_file, path, window_duration, png): path for path in files}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                summary = future.result()
+            except Exception as e:
+                summary = {'file': str(path), 'error': str(e)}
+                print(f"{path.name}: failed, {e}")
+            else:
+                verdicts = ', '.join(channel['verdict'] for channel in summary['channels']) or summary['subtype']
+                print(f"{path.name}: avg {summary['avg_bits']:.2f} bits, max {summary['max_bits']} bits, {verdicts}")
+            summaries.append(summary)
+    summaries.sort(key=lambda summary: summary['file'])
+    write_summary(summaries, summary_path)
+    print(f"Summary of {len(summaries)} files written to {summary_path}")
 
 def main():
     # parse arguments
     parser = argparse.ArgumentParser(description='Analyze bit depth of an audio file over time')
-    parser.add_argument('-i', '--input', required=True, help='Input audio file path')
+    parser.add_argument('-i', '--input', required=True,
+                       help='Input audio file path, or a directory to analyze every FLAC/WAV file in it')
     parser.add_argument('-w', '--window', type=float, default=0.5, 
                        help='Window duration in seconds (default: 0.5)')
+    parser.add_argument('--exact', action='store_true',
+                       help='Read the native integer samples of each channel and report the bits really used '
+                            '(padded LSBs and MSB headroom) instead of the average over a mono mix')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                       help='Number of files analyzed at the same time in directory mode (default: one per CPU)')
+    parser.add_argument('--summary',
+                       help=f'CSV or JSON (.json) summary written in directory mode (default: {SUMMARY_NAME} in the directory)')
+    parser.add_argument('--png', action='store_true',
+                       help='In directory mode, also save the plot of every file as <name>_bit_depth.png next to it')
+    parser.add_argument('-o', '--output',
+                       help='Save the plot to this image file (e.g. out.png) instead of showing it, no display needed')
     
     args = parser.parse_args()
     file_name = os.path.basename(args.input)
     
-    # load audio into soundfile
-    data, samplerate = sf.read(args.input, dtype='float32', always_2d=True)
-    
     # soundfile parameters
     window_duration = args.window
-    window_size = int(window_duration * samplerate)
-    step_size = window_size
-    num_windows = (len(data) - window_size) // step_size
-    min_bits = []
-    max_bits = []
-    avg_bits = []
-    times = []
     
-    # average channels to mono
-    if data.ndim > 1:
-        data = data.mean(axis=1)
+    if args.output:
+        # render off-screen, works on servers without a display
+        plt.switch_backend('Agg')
     
-    # normalize data in float [-1, 1]
-    scaled_data = (data * (2**23)).astype(np.int32)
+    if os.path.isdir(args.input):
+        if args.output:
+            parser.error("-o/--output saves a single plot, use --png in directory mode")
+        if args.jobs < 1:
+            parser.error("--jobs must be at least 1")
+        summary_path = args.summary or os.path.join(args.input, SUMMARY_NAME)
+        analyze_directory(args.input, window_duration, args.jobs, summary_path, args.png)
+        return
     
-    for i in range(0, len(scaled_data) - window_size, step_size):
-        window = scaled_data[i:i+window_size]
-        abs_vals = np.abs(window)
-        nonzero = abs_vals[abs_vals > 0]
-        if nonzero.size == 0:
-            min_b = max_b = avg_b = 0
-        else:
-            bits_used = np.floor(np.log2(nonzero)).astype(int) + 1
-            min_b = bits_used.min()
-            max_b = bits_used.max()
-            avg_b = bits_used.mean()
-        min_bits.append(min_b)
-        max_bits.append(max_b)
-        avg_bits.append(avg_b)
-        times.append(i / samplerate)
-        
-    overall_avg = np.mean(avg_bits)
-    overall_max = np.max(max_bits)
+    if args.exact:
+        subtype = sf.info(args.input).subtype
+        if subtype not in SUBTYPE_BITS:
+            print(f"--exact needs integer PCM samples, {file_name} is {subtype}")
+            return
+        # stream the file through soundfile in blocks of whole windows
+        stats = scan_file(args.input, window_duration, exact=True)
+        channels = channel_padding(stats)
+        for channel in channels:
+            print(f"Channel {channel['channel']}: {channel['verdict']}")
+        plot_padding(stats, channels, file_name, window_duration, args.output)
+        return
     
-    # plot
-    plt.figure(figsize=(12, 6))
-    plt.plot(times, min_bits, label="Min Bits Used", linewidth=0.5)
-    plt.plot(times, max_bits, label="Max Bits Used", linewidth=0.5)
-    plt.plot(times, avg_bits, label="Avg Bits Used", linewidth=0.5)
-    plt.xlabel("Time (s)")
-    plt.ylabel("Effective Bit Depth")
-    plt.title(f"{file_name}\n"
-		f"Effective Bit Usage Over Time (Per {window_duration:.2f}s Window)\n"
-        f"Overall Avg: {overall_avg:.2f} bits   Max: {overall_max:.0f} bits")
-    plt.grid(True)
-    plt.legend()
-    plt.tight_layout()
-    plt.show()
+    # stream the file through soundfile in blocks of whole windows
+    stats = scan_file(args.input, window_duration)
+    plot_usage(stats, file_name, window_duration, args.output)
 
 if __name__ == "__main__":
     main()
@@ -1,133 +1,628 @@
 """
 @author squash
 Draws the waveform of a FLAC/WAV audio file with clipping highlighted.
+Clipping is a run of consecutive samples at full scale, which can be reported as JSON.
 Colors adjustable through editing hex codes.
 
 Dependencies:
-pip install soundfile numpy matplotlib
+pip install soundfile numpy pillow
+matplotlib is only needed for --renderer matplotlib
 """
 import argparse
+import hashlib
+import io
+import json
+import os
+import tempfile
+import zipfile
 import soundfile as sf
 import numpy as np
-import matplotlib.pyplot as plt
+from PIL import Image, ImageColor, ImageDraw, ImageFont
 from pathlib import Path
 
-def visualize_waveform(input_path: str | Path, output_path: str | Path):
+# frames per peak of each zoom level of the peaks sidecar, every level a multiple of the previous one
+PEAK_LEVELS = (256, 1024, 4096, 16384, 65536)
+PEAKS_SUFFIX = '.peaks.npz'
+# bumped whenever what is stored in the peaks file changes, older peaks files are rebuilt
+PEAKS_VERSION = 3
+# errors of a truncated or otherwise unreadable peaks file, which is then rebuilt
+PEAKS_ERRORS = (zipfile.BadZipFile, OSError, ValueError, KeyError, EOFError)
+# bytes hashed at the start and the end of the file to recognize it
+HASH_SPAN = 1 << 20
+
+# bits of the integer PCM subtypes, read as float their full scale is -1.0 and (2**(bits-1) - 1) / 2**(bits-1)
+SUBTYPE_BITS = {'PCM_S8': 8, 'PCM_U8': 8, 'PCM_16': 16, 'PCM_24': 24, 'PCM_32': 32}
+# consecutive samples at full scale needed to count as clipping
+MIN_CLIP_RUN = 3
+
+# colors
+BACKGROUND_COLOR = '#141414'
+TEXT_COLOR = '#EFEFEF'
+SPINE_COLOR = '#7393B3'
+WAVEFORM_COLOR = '#A9A9A9'
+CLIPPED_COLOR = '#FF0000'
+
+# size of the raster image, the same as the 17 x 2 inch per channel matplotlib figure at 120 dpi
+IMAGE_WIDTH = 2040
+CHANNEL_HEIGHT = 240
+CHANNEL_TITLE_HEIGHT = 30
+
+def window_peaks(block: np.ndarray, window_size: int):
     """
-    Reads a FLAC/WAV file, draws its waveform by processing in chunks, and highlights clipped samples.
-    Saves the drawn image to a png file.
+    Reduces a block of frames to the max and min of each window of window_size frames.
+    The block length must be a multiple of window_size.
+
+    Returns:
+        (maxima, minima): arrays of shape (windows, channels)
+    """
+    windows = block.reshape(-1, window_size, block.shape[1])
+    return windows.max(axis=1), windows.min(axis=1)
+
+def rail_levels(subtype: str):
+    """
+    The positive and negative full scale of a soundfile subtype, as read in float. Integer PCM is
+    asymmetric, it tops out one step below 1.0 on the positive side but reaches -1.0 on the negative
+    one, so the sample one step above -1.0 is not at the rail. Float files clip at +/-1.0.
+
+    Returns:
+        (positive, negative): samples at or above positive, or at or below negative, are at a rail
+    """
+    if subtype in SUBTYPE_BITS:
+        scale = 2.0 ** (SUBTYPE_BITS[subtype] - 1)
+        return (scale - 1) / scale, -1.0
+    return 1.0 - 1e-6, -(1.0 - 1e-6)
+
+def rail_runs(rail: np.ndarray):
+    """
+    Run-length encodes the rail state of one channel (1 at the positive rail, -1 at the negative one,
+    0 otherwise) and returns the runs at a rail.
+
+    Returns:
+        (starts, ends, values): arrays of the runs, each covering frames [start, end)
+    """
+    change = np.flatnonzero(rail[1:] != rail[:-1]) + 1
+    starts = np.concatenate(([0], change))
+    ends = np.concatenate((change, [len(rail)]))
+    values = rail[starts]
+    at_rail = values != 0
+    return starts[at_rail], ends[at_rail], values[at_rail]
+
+def load_font(size: int):
+    """
+    Loads the font matplotlib would use, or a common system font, falling back to the Pillow default.
+    """
+    for name in ('DejaVuSans.ttf', 'arial.ttf'):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            pass
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        # Pillow < 10.1 has a single bitmap size
+        return ImageFont.load_default()
+
+def hex_to_rgb(color: str) -> np.ndarray:
+    return np.array([int(color[i:i + 2], 16) for i in (1, 3, 5)], dtype=np.float32)
+
+def draw_waveform(title: str, downsampled_data: np.ndarray, clipped_data: np.ndarray, output_path: str | Path):
+    """
+    Draws the downsampled max/min pairs of every channel straight into an RGB array, one bar per pixel
+    column, and saves it with Pillow. Same colours and layout as plot_waveform but without matplotlib,
+    the memory used only depends on the image size.
 
     Arguments:
-        input_path (str): The path to the input FLAC file.
+        title (str): The title drawn above the channels.
+        downsampled_data (np.ndarray): max/min pairs of the non-clipped windows, NaN for clipped ones,
+            shape (channels, 2 * windows).
+        clipped_data (np.ndarray): max/min pairs of the clipped windows, NaN for the others, same shape.
         output_path (str): The path to save the output PNG image.
     """
-    input_path = Path(input_path)
-    output_path = Path(output_path)
-    
-    if not input_path.exists():
-        print(f"Failed to find '{input_path}'")
-        return
+    num_channels = downsampled_data.shape[0]
+    width, height = IMAGE_WIDTH, CHANNEL_HEIGHT * num_channels
+    image = np.empty((height, width, 3), dtype=np.float32)
+    image[:] = hex_to_rgb(BACKGROUND_COLOR)
 
-    try:
-        print(f"Reading chunks for {input_path.name}...")
-        # get file information without loading all data into memory
-        # to avoid memory overflow
-        info = sf.info(str(input_path))
-        num_channels = info.channels
-        samplerate = info.samplerate
-        total_samples = info.frames
+    # reduce the windows to one max/min bar per pixel column, separately for the non-clipped and the
+    # clipped windows so only the clipped extent of a column is red; fmax/fmin skip the NaN windows
+    left, right = 56, width - 31
+    columns = right - left - 1
+    num_windows = downsampled_data.shape[1] // 2
+    starts = np.arange(columns) * num_windows // columns
+    envelopes = [(np.fmax.reduceat(data[:, 0::2], starts, axis=1), np.fmin.reduceat(data[:, 1::2], starts, axis=1))
+                 for data in (downsampled_data, clipped_data)]
 
-        # downsample the data to a fixed number of points for drawing
-        # prevents plotting too many points for very long files
-        target_points = 50000
-        if total_samples > target_points:
-            downsample_factor = int(total_samples / target_points)
-        else:
-            downsample_factor = 1
+    # the figure title takes the top 5%, each channel an equal share of the rest
+    header, footer = max(46, height // 20), max(14, height * 3 // 100)
+    row_height = (height - header - footer) // num_channels
+    labels = []
+    for i in range(num_channels):
+        top = header + i * row_height + CHANNEL_TITLE_HEIGHT
+        bottom = header + (i + 1) * row_height - 8
+        labels.append((f'Channel {i + 1}', top - CHANNEL_TITLE_HEIGHT // 2))
 
-        # use a large buffer size for reading, more efficient for sf.blocks
-        # use a multiple of the downsample factor to make chunking easier
-        chunk_size_samples = int(samplerate * 5)
-        
-        # store the downsampled data and clipping status
-        downsampled_data = [[] for _ in range(num_channels)]
-        clipped_status = [[] for _ in range(num_channels)]
-        
-        # process the audio file in chunks
-        with sf.SoundFile(str(input_path), 'r') as f:
-            for block in f.blocks(blocksize=chunk_size_samples, dtype='float32'):
-                if block.ndim == 1:
-                    block = block.reshape(-1, 1)
-
-                # add the data from this block
-                for i, channel_data in enumerate(block.T):
-                    for j in range(0, len(channel_data), downsample_factor):
-                        window = channel_data[j:j+downsample_factor]
-                        if len(window) > 0:
-                            # use min/max to represent the waveform range
-                            downsampled_data[i].append(np.max(window))
-                            downsampled_data[i].append(np.min(window))
-                            
-                            # check for clipping
-                            is_clipped = np.any(np.abs(window) >= 1.0 - 1e-6)
-                            clipped_status[i].append(is_clipped)
-                            clipped_status[i].append(is_clipped) # add it twice for the min/max pair
-        
-        print(f"Plotting waveforms for {input_path.name}...")
+        # y of a value inside the axes box, the axes span -1.1 to 1.1 like plot_waveform
+        inner = bottom - top - 1
+        def to_row(values):
+            return np.rint(top + 1 + (1.1 - values) / 2.2 * (inner - 1)).astype(np.int32)
+        rows = np.arange(top + 1, bottom)[:, None]
+        bars, fills = [], []
+        for maxima, minima in envelopes:
+            # columns without windows of this kind are NaN and get no bar
+            present = ~np.isnan(maxima[i])
+            maxima, minima = np.nan_to_num(maxima[i]), np.nan_to_num(minima[i])
+            bars.append((rows >= to_row(maxima)) & (rows <= to_row(minima)) & present)
+            fills.append((rows >= to_row(np.maximum(maxima, 0))) & (rows <= to_row(np.minimum(minima, 0))) & present)
+
+        area = image[top + 1:bottom, left + 1:right]
+        for color, alpha, mask in ((WAVEFORM_COLOR, 0.3, fills[0]), (CLIPPED_COLOR, 0.5, fills[1])):
+            area[mask] = area[mask] * (1 - alpha) + hex_to_rgb(color) * alpha
+        area[bars[0]] = hex_to_rgb(WAVEFORM_COLOR)
+        area[bars[1]] = hex_to_rgb(CLIPPED_COLOR)
+
+        # axes box
+        image[[top, bottom], left:right + 1] = hex_to_rgb(SPINE_COLOR)
+        image[top:bottom + 1, [left, right]] = hex_to_rgb(SPINE_COLOR)
+
+    output = Image.fromarray(image.astype(np.uint8))
+    draw = ImageDraw.Draw(output)
+    text_color = ImageColor.getrgb(TEXT_COLOR)
+    draw.text((width // 2, header // 2), title, fill=text_color, font=load_font(27), anchor='mm')
+    font = load_font(20)
+    for label, y in labels:
+        draw.text(((left + right) // 2, y), label, fill=text_color, font=font, anchor='mm')
+    output.save(output_path)
+
+def plot_waveform(title: str, downsampled_data: np.ndarray, clipped_data: np.ndarray, total_duration: float,
+                  output_path: str | Path):
+    """
+    Plots the downsampled max/min pairs of every channel with matplotlib and saves the figure.
+
+    Arguments:
+        title (str): The title of the figure.
+        downsampled_data (np.ndarray): max/min pairs of the non-clipped windows, NaN for clipped ones,
+            shape (channels, 2 * windows).
+        clipped_data (np.ndarray): max/min pairs of the clipped windows, NaN for the others, same shape.
+        total_duration (float): The duration of the file in seconds.
+        output_path (str): The path to save the output PNG image.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    num_channels = downsampled_data.shape[0]
+    try:
         # create the figure with downsampled data
         fig, axes = plt.subplots(
             nrows=num_channels, 
             ncols=1, 
             figsize=(17, 2 * num_channels), 
             sharex=True,
-            facecolor='#141414'
+            facecolor=BACKGROUND_COLOR
         )
 
         if num_channels == 1:
             axes = [axes]
         
         # set the title for the figure
-        plt.suptitle(input_path.name, fontsize=16, color='#EFEFEF')
+        plt.suptitle(title, fontsize=16, color=TEXT_COLOR)
         plt.tight_layout(rect=[0, 0.03, 1, 0.95])
 
-        total_downsampled_points = len(downsampled_data[0])
-        total_duration = total_samples / samplerate
+        total_downsampled_points = downsampled_data.shape[1]
         time_downsampled = np.linspace(0, total_duration, total_downsampled_points)
 
         for i, ax in enumerate(axes):
-            ax.set_facecolor('#141414')
+            ax.set_facecolor(BACKGROUND_COLOR)
             ax.set_yticks([])
             ax.set_xticks([])
             for spine in ax.spines.values():
-                spine.set_edgecolor('#7393B3')
+                spine.set_edgecolor(SPINE_COLOR)
             ax.set_xlim(time_downsampled[0], time_downsampled[-1])
-            channel_data = np.array(downsampled_data[i])
-            channel_clipped = np.array(clipped_status[i])
+            non_clipped_data = downsampled_data[i]
+            channel_clipped_data = clipped_data[i]
 
             # plot the non-clipped waveforms
-            non_clipped_data = np.where(channel_clipped, np.nan, channel_data)
-            ax.plot(time_downsampled, non_clipped_data, color='#A9A9A9', linewidth=0.5) # EFEFEF
+            ax.plot(time_downsampled, non_clipped_data, color=WAVEFORM_COLOR, linewidth=0.5) # EFEFEF
 
             # plot clipped samples
-            clipped_data = np.where(~channel_clipped, np.nan, channel_data)
-            ax.plot(time_downsampled, clipped_data, color='red', linewidth=0.5)
+            ax.plot(time_downsampled, channel_clipped_data, color=CLIPPED_COLOR, linewidth=0.5)
             
-            ax.fill_between(time_downsampled, 0, non_clipped_data, color='#A9A9A9', alpha=0.3)
-            ax.fill_between(time_downsampled, 0, clipped_data, color='red', alpha=0.5)
+            ax.fill_between(time_downsampled, 0, non_clipped_data, color=WAVEFORM_COLOR, alpha=0.3)
+            ax.fill_between(time_downsampled, 0, channel_clipped_data, color=CLIPPED_COLOR, alpha=0.5)
             
             ax.set_ylim(-1.1, 1.1)
-            ax.set_title(f'Channel {i + 1}', color='#EFEFEF')
+            ax.set_title(f'Channel {i + 1}', color=TEXT_COLOR)
             ax.grid(True)
 
         # save the image
         plt.savefig(output_path, dpi=120)
+    finally:
+        # close the plot to free up memory
+        plt.close()
+
+def read_peaks(input_path: str | Path, window_size: int, start: int = 0, frames: int = -1,
+               min_run: int = MIN_CLIP_RUN):
+    """
+    Decodes frames frames of a FLAC/WAV file from frame start in chunks and reduces them to the max and min
+    of each window of window_size frames. The last window may be partial.
+    In the same pass, finds the clipping of every channel: runs of at least min_run consecutive samples at
+    the same rail. Windows overlapping a run are flagged as clipped.
+
+    Returns:
+        (maxima, minima, clipped, runs): arrays of shape (channels, windows), and per channel an array
+        of its runs as rows of [first frame, end frame, rail (1 or -1)], frames counted from the file start
+    """
+    with sf.SoundFile(str(input_path), 'r') as f:
+        if frames < 0:
+            frames = f.frames - start
+        num_channels = f.channels
+        positive_rail, negative_rail = rail_levels(f.subtype)
+
+        # use a large buffer size for reading, more efficient for sf.blocks
+        # use a multiple of the window size to make chunking easier
+        chunk_size_samples = max(1, int(f.samplerate * 5) // window_size) * window_size
+
+        # store the downsampled data, preallocated from the frame count
+        num_windows = -(-frames // window_size)
+        maxima = np.zeros((num_channels, num_windows), dtype=np.float32)
+        minima = np.zeros((num_channels, num_windows), dtype=np.float32)
+
+        # process the audio file in chunks
+        window = 0
+        position = start
+        carry = np.empty((0, num_channels), dtype=np.float32)
+        runs = [[] for _ in range(num_channels)]
+        # the [start, rail] of a run still going at the end of the previous block
+        open_runs = [None] * num_channels
+        f.seek(start)
+        for block in f.blocks(blocksize=chunk_size_samples, frames=frames, dtype='float32', always_2d=True):
+            # find the runs at a rail, carrying the last one over to the next block
+            state = (block >= positive_rail).astype(np.int8) - (block <= negative_rail)
+            for i in np.flatnonzero(state.any(axis=0) | [run is not None for run in open_runs]):
+                starts, ends, values = rail_runs(state[:, i])
+                starts += position
+                ends += position
+                if open_runs[i] is not None:
+                    if len(starts) and starts[0] == position and values[0] == open_runs[i][1]:
+                        starts[0] = open_runs[i][0]
+                    else:
+                        runs[i].append([[open_runs[i][0], position, open_runs[i][1]]])
+                    open_runs[i] = None
+                if len(starts) and ends[-1] == position + len(block):
+                    open_runs[i] = (starts[-1], values[-1])
+                    starts, ends, values = starts[:-1], ends[:-1], values[:-1]
+                runs[i].append(np.column_stack((starts, ends, values)))
+            position += len(block)
+
+            # a window cut by the end of the previous block continues in this one
+            if len(carry):
+                block = np.concatenate((carry, block))
+            end = len(block) - len(block) % window_size
+            carry = block[end:]
+            if end == 0:
+                continue
+
+            # add the data from this block, use min/max to represent the waveform range
+            block_max, block_min = window_peaks(block[:end], window_size)
+            count = len(block_max)
+            maxima[:, window:window + count] = block_max.T
+            minima[:, window:window + count] = block_min.T
+            window += count
+
+        # the last window of the file may be partial
+        if len(carry):
+            block_max, block_min = window_peaks(carry, len(carry))
+            maxima[:, window] = block_max[0]
+            minima[:, window] = block_min[0]
+            window += 1
+
+    # frames may differ from info.frames for some broken files
+    maxima, minima = maxima[:, :window], minima[:, :window]
+    clipped = np.zeros(maxima.shape, dtype=bool)
+    for i in range(num_channels):
+        if open_runs[i] is not None:
+            runs[i].append([[open_runs[i][0], position, open_runs[i][1]]])
+        channel_runs = np.concatenate(runs[i] + [np.empty((0, 3))]).astype(np.int64)
+        runs[i] = channel_runs[channel_runs[:, 1] - channel_runs[:, 0] >= min_run]
+        clipped[i] = runs_to_windows(runs[i], start, window_size, window)
+    return maxima, minima, clipped, runs
+
+def split_clipped(maxima: np.ndarray, minima: np.ndarray, clipped: np.ndarray):
+    """
+    Splits the max/min of each window into the non-clipped and the clipped ones, NaN where a window
+    is of the other kind.
+
+    Returns:
+        (maxima, minima, clip_maxima, clip_minima): arrays of the same shape as maxima
+    """
+    return (np.where(clipped, np.nan, maxima), np.where(clipped, np.nan, minima),
+            np.where(clipped, maxima, np.nan), np.where(clipped, minima, np.nan))
+
+def runs_to_windows(runs: np.ndarray, start: int, window_size: int, num_windows: int) -> np.ndarray:
+    """
+    Flags the windows of window_size frames from frame start that overlap any of the runs.
+    """
+    first = np.clip((runs[:, 0] - start) // window_size, 0, num_windows)
+    last = np.clip((runs[:, 1] - 1 - start) // window_size + 1, 0, num_windows)
+    # +1 where a run starts covering windows and -1 where it stops
+    edges = np.zeros(num_windows + 1, dtype=np.int64)
+    np.add.at(edges, first, 1)
+    np.add.at(edges, last, -1)
+    return np.cumsum(edges[:-1]) > 0
+
+def clipping_report(input_path: Path, samplerate: int, runs: list, min_run: int) -> dict:
+    """
+    Summary of the clipping runs of every channel, with their timestamps in seconds.
+    """
+    channels = []
+    for i, channel_runs in enumerate(runs):
+        lengths = channel_runs[:, 1] - channel_runs[:, 0]
+        channels.append({
+            'channel': i + 1,
+            'runs': len(channel_runs),
+            'clipped_samples': int(lengths.sum()),
+            'longest_run': int(lengths.max()) if len(lengths) else 0,
+            'clips': [{
+                'start': round(int(run_start) / samplerate, 6),
+                'end': round(int(run_end) / samplerate, 6),
+                'samples': int(run_end - run_start),
+                'rail': '+' if value > 0 else '-',
+            } for run_start, run_end, value in channel_runs],
+        })
+    return {
+        'file': str(input_path),
+        'samplerate': samplerate,
+        'min_run': min_run,
+        'runs': sum(channel['runs'] for channel in channels),
+        'channels': channels,
+    }
+
+def peaks_paths(input_path: Path):
+    """
+    Locations the peaks file of input_path may be stored at, in order of preference: next to the
+    audio file, then the user cache directory for files in read-only folders.
+    """
+    input_path = input_path.resolve()
+    cache_dir = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'gen_waveforms'
+    digest = hashlib.sha1(str(input_path).encode('utf-8')).hexdigest()
+    return [input_path.with_name(input_path.name + PEAKS_SUFFIX), cache_dir / (digest + PEAKS_SUFFIX)]
+
+def content_hash(input_path: Path) -> str:
+    """
+    Hash of the size and the first and last MiB of a file, enough to recognize a copied or touched file
+    without reading all of it.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    size = input_path.stat().st_size
+    digest.update(str(size).encode())
+    with open(input_path, 'rb') as f:
+        digest.update(f.read(HASH_SPAN))
+        if size > HASH_SPAN:
+            f.seek(max(HASH_SPAN, size - HASH_SPAN))
+            digest.update(f.read(HASH_SPAN))
+    return digest.hexdigest()
+
+def build_peaks(input_path: Path, min_run: int = MIN_CLIP_RUN) -> dict:
+    """
+    Decodes the file once into the finest peak level and returns every zoom level, as saved in the peaks file.
+    Each level is the max/min of the non-clipped and of the clipped windows of PEAK_LEVELS[0] frames within
+    PEAK_LEVELS[i] frames per channel, NaN if there are none, so a peak that is only partly clipped keeps
+    both extents. Coarser levels are reduced from the previous one.
+    """
+    info = sf.info(str(input_path))
+    maxima, minima, clipped, runs = read_peaks(input_path, PEAK_LEVELS[0], min_run=min_run)
+    envelopes = split_clipped(maxima, minima, clipped)
+    stat = input_path.stat()
+    arrays = {
+        'version': np.int64(PEAKS_VERSION),
+        'size': np.int64(stat.st_size),
+        'mtime_ns': np.int64(stat.st_mtime_ns),
+        'hash': np.str_(content_hash(input_path)),
+        'samplerate': np.int64(info.samplerate),
+        'frames': np.int64(info.frames),
+        'levels': np.array(PEAK_LEVELS, dtype=np.int64),
+        'min_run': np.int64(min_run),
+        # the clipping runs of all channels as rows of [channel, first frame, end frame, rail]
+        'runs': np.concatenate([np.column_stack((np.full(len(channel_runs), i), channel_runs))
+                                for i, channel_runs in enumerate(runs)]).astype(np.int64),
+    }
+    for previous, level in zip((PEAK_LEVELS[0],) + PEAK_LEVELS, PEAK_LEVELS):
+        if level != previous:
+            # fmax/fmin skip the NaN of windows of the other kind
+            starts = np.arange(0, envelopes[0].shape[1], level // previous)
+            envelopes = [reduce.reduceat(envelope, starts, axis=1)
+                         for reduce, envelope in zip((np.fmax, np.fmin, np.fmax, np.fmin), envelopes)]
+        # half precision is plenty to draw
+        for name, envelope in zip(('max', 'min', 'clipmax', 'clipmin'), envelopes):
+            arrays[f'{name}_{level}'] = envelope.astype(np.float16)
+    return arrays
+
+def save_peaks(input_path: Path, arrays: dict) -> Path | None:
+    """
+    Writes the peaks file to the first writable location of peaks_paths. It is written to a temporary
+    file that replaces the old one at once, so an interrupted run never leaves a truncated peaks file.
+    Returns the path written to, or None if no location was writable.
+    """
+    # NamedTemporaryFile creates the file as 0600, give it the mode a plain open() would
+    umask = os.umask(0)
+    os.umask(umask)
+    for path in peaks_paths(input_path):
+        temp_path = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile('wb', dir=path.parent, prefix=path.name, suffix='.tmp',
+                                             delete=False) as f:
+                temp_path = f.name
+                # np.savez adds .npz to names without it
+                np.savez(f, **arrays)
+            os.chmod(temp_path, 0o666 & ~umask)
+            os.replace(temp_path, path)
+        except OSError:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.unlink(temp_path)
+            continue
+        return path
+    return None
+
+def load_peaks(path: Path, input_path: Path, min_run: int):
+    """
+    Opens the peaks file at path if it matches input_path: the same PEAKS_VERSION, the same size and
+    either the same mtime or the same content hash, and clipping found with the same min_run.
+    Returns None if it doesn't match or can't be read.
+    """
+    try:
+        peaks = np.load(path)
+    except PEAKS_ERRORS:
+        return None
+    try:
+        stat = input_path.stat()
+        if (int(peaks['version']) == PEAKS_VERSION and int(peaks['min_run']) == min_run
+                and int(peaks['size']) == stat.st_size
+                and (int(peaks['mtime_ns']) == stat.st_mtime_ns or str(peaks['hash']) == content_hash(input_path))):
+            return peaks
+    except PEAKS_ERRORS:
+        pass
+    peaks.close()
+    return None
+
+def open_peaks(input_path: Path, min_run: int = MIN_CLIP_RUN, rebuild: bool = False):
+    """
+    Opens the peaks file of a file if there is a valid one, rebuilding it if it's missing, stale or
+    unreadable (or if rebuild is set). If no location is writable the peaks are kept in memory.
+    Arrays of the returned NpzFile are only read when accessed.
+    """
+    stale = []
+    for path in peaks_paths(input_path):
+        if path.exists() and not rebuild:
+            peaks = load_peaks(path, input_path, min_run)
+            if peaks is not None:
+                print(f"Using peaks from '{path}'")
+                return peaks
+            stale.append(path)
+    if stale:
+        print(f"'{stale[0]}' is out of date or unreadable, rebuilding it...")
+    arrays = build_peaks(input_path, min_run)
+    path = save_peaks(input_path, arrays)
+    if path is None:
+        print("Could not write the peaks file, the next run will decode the file again")
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        buffer.seek(0)
+        return np.load(buffer)
+    print(f"Peaks written to '{path}'")
+    return np.load(path)
+
+def cached_peaks(input_path: Path, start: int, frames: int, target_points: int, min_run: int = MIN_CLIP_RUN):
+    """
+    Reads the coarsest zoom level that still has target_points windows between frame start and
+    start + frames from the peaks sidecar, and the clipping runs overlapping that range.
+
+    Returns:
+        (maxima, minima, clip_maxima, clip_minima, runs): the windows split like split_clipped does,
+        and the runs the same as read_peaks
+    """
+    try:
+        return read_levels(open_peaks(input_path, min_run), start, frames, target_points)
+    except PEAKS_ERRORS:
+        # a damaged array only shows up when it is read
+        return read_levels(open_peaks(input_path, min_run, rebuild=True), start, frames, target_points)
+
+def read_levels(peaks, start: int, frames: int, target_points: int):
+    """
+    The zoom level and runs cached_peaks reads, from an open peaks file that is closed afterwards.
+    """
+    with peaks:
+        levels = [int(level) for level in peaks['levels']]
+        level = max([level for level in levels if frames // level >= target_points], default=levels[0])
+        first, last = start // level, -(-(start + frames) // level)
+        all_runs = peaks['runs']
+        all_runs = all_runs[(all_runs[:, 2] > start) & (all_runs[:, 1] < start + frames)]
+        # every array access of an NpzFile reads it from the file again
+        envelopes = [peaks[f'{name}_{level}'][:, first:last].astype(np.float32)
+                     for name in ('max', 'min', 'clipmax', 'clipmin')]
+        runs = [all_runs[all_runs[:, 0] == i, 1:] for i in range(envelopes[0].shape[0])]
+        return (*envelopes, runs)
+
+def visualize_waveform(input_path: str | Path, output_path: str | Path, renderer: str = 'raster',
+                       use_peaks: bool = False, start_time: float = 0.0, end_time: float | None = None,
+                       min_run: int = MIN_CLIP_RUN, report_path: str | Path | None = None):
+    """
+    Reads a FLAC/WAV file, draws its waveform by processing in chunks, and highlights clipped samples.
+    Saves the drawn image to a png file.
+
+    Arguments:
+        input_path (str): The path to the input FLAC file.
+        output_path (str): The path to save the output PNG image.
+        renderer (str): 'raster' to draw the image directly with Pillow, 'matplotlib' to plot it.
+        use_peaks (bool): Read the peaks from the <input>.peaks.npz sidecar, writing it first if needed.
+        start_time (float): Start of the drawn range in seconds.
+        end_time (float): End of the drawn range in seconds, the end of the file if None.
+        min_run (int): Consecutive samples at full scale that count as clipping and get highlighted.
+        report_path (str): The path to save the JSON report of the clipping runs to, if any.
+    """
+    input_path = Path(input_path)
+    output_path = Path(output_path)
+    
+    if not input_path.exists():
+        print(f"Failed to find '{input_path}'")
+        return
+
+    try:
+        print(f"Reading chunks for {input_path.name}...")
+        # get file information without loading all data into memory
+        # to avoid memory overflow
+        info = sf.info(str(input_path))
+        samplerate = info.samplerate
+        start = min(int(start_time * samplerate), info.frames)
+        end = info.frames if end_time is None else min(int(end_time * samplerate), info.frames)
+        total_samples = end - start
+        if total_samples <= 0:
+            print(f"Nothing to draw between {start_time}s and {end_time}s")
+            return
+
+        # downsample the data to a fixed number of points for drawing
+        # prevents plotting too many points for very long files
+        target_points = 50000
+        if use_peaks:
+            # the raster renderer only needs a window per pixel column
+            level_points = target_points if renderer == 'matplotlib' else IMAGE_WIDTH
+            maxima, minima, clip_maxima, clip_minima, runs = cached_peaks(input_path, start, total_samples,
+                                                                          level_points, min_run)
+        else:
+            if total_samples > target_points:
+                downsample_factor = int(total_samples / target_points)
+            else:
+                downsample_factor = 1
+            maxima, minima, clipped, runs = read_peaks(input_path, downsample_factor, start, total_samples, min_run)
+            maxima, minima, clip_maxima, clip_minima = split_clipped(maxima, minima, clipped)
+
+        report = clipping_report(input_path, samplerate, runs, min_run)
+        for channel in report['channels']:
+            if channel['runs']:
+                print(f"Channel {channel['channel']}: {channel['runs']} clipping runs, "
+                      f"{channel['clipped_samples']} samples, longest {channel['longest_run']}")
+        if report_path:
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print(f"Clipping report written to '{report_path}'")
+
+        # a max/min pair per window, for the non-clipped and the clipped windows
+        downsampled_data = np.empty((maxima.shape[0], 2 * maxima.shape[1]), dtype=np.float32)
+        downsampled_data[:, 0::2] = maxima
+        downsampled_data[:, 1::2] = minima
+        clipped_data = np.empty_like(downsampled_data)
+        clipped_data[:, 0::2] = clip_maxima
+        clipped_data[:, 1::2] = clip_minima
+        
+        print(f"Drawing waveforms for {input_path.name}...")
+        if renderer == 'matplotlib':
+            plot_waveform(input_path.name, downsampled_data, clipped_data, total_samples / samplerate, output_path)
+        else:
+            draw_waveform(input_path.name, downsampled_data, clipped_data, output_path)
         print(f"Successfully generated waveform image: '{output_path}'")
 
     except Exception as e:
         print(f"An error occurred: {e}")
-    finally:
-        # close the plot to free up memory
-        plt.close()
 
 
 if __name__ == "__main__":
@@ -136,6 +631,18 @@ if __name__ == "__main__":
                         help='Path to the input FLAC/WAV file.')
     parser.add_argument('-o', '--output', type=str, required=False, default='waveform_with_clipping.png',
                         help='Path to the output PNG image.')
+    parser.add_argument('--renderer', choices=['raster', 'matplotlib'], default='raster',
+                        help='Draw the image directly with Pillow (default, faster) or plot it with matplotlib.')
+    parser.add_argument('--peaks', action='store_true',
+                        help=f'Read the peaks from <input>{PEAKS_SUFFIX} instead of decoding the file, writing it on first use.')
+    parser.add_argument('--min-run', type=int, default=MIN_CLIP_RUN,
+                        help=f'Consecutive samples at full scale that count as clipping (default: {MIN_CLIP_RUN}).')
+    parser.add_argument('--clip-report', type=str, default=None,
+                        help='Path to save a JSON report of the clipping runs of every channel to.')
+    parser.add_argument('--start', type=float, default=0.0,
+                        help='Start of the drawn range in seconds.')
+    parser.add_argument('--end', type=float, default=None,
+                        help='End of the drawn range in seconds (default: end of the file).')
     
     args = parser.parse_args()
 
@@ -154,4 +661,7 @@ if __name__ == "__main__":
         stereo_data = np.vstack([sine_wave, clipped_wave]).T
         sf.write(args.input, stereo_data, samplerate)
 
-    visualize_waveform(args.input, args.output)
+    if args.min_run < 1:
+        parser.error("--min-run must be at least 1")
+    visualize_waveform(args.input, args.output, args.renderer, args.peaks, args.start, args.end,
+                       args.min_run, args.clip_report)
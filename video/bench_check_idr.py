@@ -0,0 +1,667 @@
+"""
+Generates synthetic H.264, HEVC, MPEG-2 and VC-1 elementary streams with a known set of safe cut
+frames and benchmarks the check_idr.py scanners against them.
+
+The streams carry the start code and header structure the scanners parse (parameter sets,
+sequence/GOP/entry point headers, picture and slice headers) with filler payload, so they
+can't be decoded. The payload is either left as holes of a sparse file, which makes streams
+of tens of GB cheap to create, or filled with random bytes that contain no start codes.
+The safe cut frames and their byte offsets are written next to the stream as <stream>.truth.json.
+
+Dependencies:
+pip install rich av
+
+@version 1.0
+"""
+import abc
+import argparse
+import contextlib
+import json
+import math
+import os
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import check_idr  # noqa: E402
+
+console = Console(color_system="truecolor")
+
+# generated codec -> file extension
+EXTENSIONS = {
+    'h264': '.h264',
+    'hevc': '.hevc',
+    'mpeg2': '.m2v',
+    'vc1': '.vc1',
+}
+TRUTH_SUFFIX = '.truth.json'
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+# default GOP, display order: two leading B-frames, then an I-frame and P-frames every third frame
+DEFAULT_GOP = 'BBIBBPBBPBBP'
+DEFAULT_FRAME_SIZE = 64 * 1024
+# relative size of I-, P- and B-frames, scaled so the average frame is --frame-size
+FRAME_WEIGHTS = {'I': 4.0, 'P': 2.0, 'B': 1.0}
+# frame sizes vary randomly by this fraction around their weight
+FRAME_SIZE_JITTER = 0.25
+# random bytes the payload of --payload random is cut from
+RANDOM_BLOCK_SIZE = 16 * 1024 * 1024
+
+# 1920x1080 in 16x16 macroblocks, 1088 coded lines
+WIDTH_MBS = 120
+HEIGHT_MBS = 68
+FRAME_RATE = 24
+
+# H.264 NAL header bytes (forbidden_zero_bit, nal_ref_idc, nal_unit_type)
+H264_NAL_AUD = 0x09
+H264_NAL_SPS = 0x67
+H264_NAL_PPS = 0x68
+H264_NAL_IDR = 0x65
+H264_NAL_REF_SLICE = 0x61       # I-frames of open GOPs
+H264_NAL_P_SLICE = 0x41
+H264_NAL_B_SLICE = 0x01         # non-reference
+# slice_type (ITU-T H.264 Table 7-6, all slices of the picture have the same type)
+H264_SLICE_TYPES = {'I': 7, 'P': 5, 'B': 6}
+# primary_pic_type of the access unit delimiter (ITU-T H.264 Table 7-5)
+H264_PRIMARY_PIC_TYPES = {'I': 0, 'P': 1, 'B': 2}
+
+# HEVC nal_unit_type (ITU-T H.265 Table 7-1) and slice_type (Table 7-7)
+HEVC_NAL_TRAIL_N = 0            # non-reference B-frames
+HEVC_NAL_TRAIL_R = 1
+HEVC_NAL_RADL_N = 6             # leading B-frames of closed GOPs
+HEVC_NAL_RASL_N = 8             # leading B-frames of open GOPs
+HEVC_NAL_IDR_W_RADL = 19
+HEVC_NAL_IDR_N_LP = 20
+HEVC_NAL_CRA = 21
+HEVC_NAL_VPS = 32
+HEVC_NAL_SPS = 33
+HEVC_NAL_PPS = 34
+HEVC_NAL_AUD = 35
+HEVC_SLICE_TYPES = {'B': 0, 'P': 1, 'I': 2}
+# 1920x1080 in 64x64 coding tree blocks, bits of slice_segment_address
+HEVC_CTB_ADDRESS_BITS = (30 * 17 - 1).bit_length()
+
+# MPEG-2 picture_coding_type (ISO/IEC 13818-2 Table 6-12)
+MPEG2_CODING_TYPES = {'I': 1, 'P': 2, 'B': 3}
+
+# VC-1 PTYPE codes of progressive Advanced Profile frames (SMPTE 421M Table 35), (bits, value)
+VC1_PTYPES = {'I': (3, 0b110), 'P': (1, 0b0), 'B': (2, 0b10)}
+
+
+class BitWriter:
+    """
+    Packs header fields MSB first.
+    """
+
+    def __init__(self):
+        self.value = 0
+        self.bits = 0
+
+    def u(self, bits: int, value: int):
+        """Fixed length unsigned field."""
+        self.value = (self.value << bits) | (value & ((1 << bits) - 1))
+        self.bits += bits
+        return self
+
+    def ue(self, value: int):
+        """Exp-Golomb coded unsigned field."""
+        length = (value + 1).bit_length()
+        return self.u(2 * length - 1, value + 1)
+
+    def se(self, value: int):
+        """Exp-Golomb coded signed field."""
+        return self.ue(2 * value - 1 if value > 0 else -2 * value)
+
+    def to_bytes(self) -> bytes:
+        """The fields followed by a stop bit and zero bits up to the next byte."""
+        self.u(1, 1)
+        self.u(-self.bits % 8, 0)
+        return self.value.to_bytes(self.bits // 8, 'big')
+
+
+def _escape(rbsp: bytes) -> bytes:
+    """
+    Inserts emulation prevention bytes so header fields never form a start code.
+    """
+    return re.sub(rb'\x00\x00(?=[\x00-\x03])', b'\x00\x00\x03', rbsp)
+
+
+def _unit(code: int, payload: bytes = b'', zero_byte: bool = False) -> bytes:
+    """
+    Start code with the one-byte suffix/NAL header code, followed by payload.
+    zero_byte: 4-byte start code, used for the first unit of an access unit or GOP.
+    """
+    return (b'\x00' if zero_byte else b'') + check_idr.START_CODE + bytes([code]) + _escape(payload)
+
+
+def parse_size(value: str) -> int:
+    """
+    argparse type of sizes: bytes, or a number with a K, M, G or T suffix (binary units).
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*', value, re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid size: {value!r}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def gop_pattern(value: str) -> str:
+    """
+    argparse type of --gop: I, P and B frames in display order with exactly one I-frame, e.g.
+    BBIBBPBBPBBP. B-frames in front of the I-frame are its leading pictures, which reference
+    the previous GOP in an open GOP. The pattern can't end with a B-frame, those belong in
+    front of the next I-frame.
+    """
+    pattern = value.strip().upper()
+    if not re.fullmatch(r'B*I[PB]*', pattern) or pattern.endswith('B'):
+        raise argparse.ArgumentTypeError(f"invalid GOP pattern: {value!r}, expected e.g. {DEFAULT_GOP}")
+    return pattern
+
+
+def decode_order(pattern: str):
+    """
+    (frame type, display index) of every frame of a display order GOP pattern in decode order:
+    each I/P-frame is decoded before the B-frames displayed in front of it.
+    """
+    order = []
+    pending_b = []
+    for display, frame_type in enumerate(pattern):
+        if frame_type == 'B':
+            pending_b.append((frame_type, display))
+        else:
+            order.append((frame_type, display))
+            order.extend(pending_b)
+            pending_b = []
+    return order
+
+
+class StreamWriter(abc.ABC):
+    """
+    Writes the headers of a synthetic stream and fills the space of each frame with payload.
+    Subclasses write the headers of one codec.
+    """
+    codec = None
+
+    def __init__(self, f, slices: int, payload: str, rng: random.Random):
+        self.f = f
+        self.slices = slices
+        self.rng = rng
+        self.block = None
+        if payload == 'random':
+            # no two zero bytes in a row, so the payload never contains a start code
+            block = rng.getrandbits(RANDOM_BLOCK_SIZE * 8).to_bytes(RANDOM_BLOCK_SIZE, 'little')
+            self.block = block.replace(b'\x00\x00', b'\x00\x80')
+
+    def fill(self, size: int):
+        """Payload of size bytes, a hole in the file or random bytes."""
+        if size <= 0:
+            return
+        if self.block is None:
+            self.f.seek(size, os.SEEK_CUR)
+            return
+        while size > 0:
+            chunk = min(size, len(self.block) // 2)
+            start = self.rng.randrange(len(self.block) - chunk)
+            self.f.write(self.block[start:start + chunk])
+            size -= chunk
+
+    def write_slices(self, frame_size: int, slice_header):
+        """Splits frame_size over the slices of a frame, slice_header(n) returns the n-th header."""
+        for n in range(self.slices):
+            header = slice_header(n)
+            self.f.write(header)
+            self.fill(frame_size // self.slices - len(header))
+
+    @abc.abstractmethod
+    def start_gop(self, gop: int, first_frame: int, closed: bool):
+        """Writes the headers in front of a GOP, the safe cut point of a closed GOP is in front of them."""
+
+    @abc.abstractmethod
+    def write_frame(self, frame_type: str, frame: int, display: int, frame_size: int, closed: bool):
+        """Writes one frame of frame_size bytes, frame is its decode order number, display its index in the GOP."""
+
+
+class H264Writer(StreamWriter):
+    """
+    Annex B byte stream: every access unit opens with an AUD, I-frames also carry the SPS and PPS.
+    Closed GOPs start with an IDR picture, open GOPs with a non-IDR I picture.
+    """
+    codec = 'h264'
+
+    SPS = (BitWriter().u(8, 100).u(8, 0).u(8, 41)        # High profile, level 4.1
+           .ue(0).ue(1).ue(0).ue(0).u(1, 0).u(1, 0)      # sps_id, 4:2:0, 8 bit, no scaling matrices
+           .ue(0).ue(0).ue(2)                            # log2_max_frame_num 4, POC type 0, log2_max_poc_lsb 6
+           .ue(4).u(1, 0)                                # max_num_ref_frames
+           .ue(WIDTH_MBS - 1).ue(HEIGHT_MBS - 1)
+           .u(1, 1).u(1, 1)                              # frame_mbs_only, direct_8x8_inference
+           .u(1, 1).ue(0).ue(0).ue(0).ue(4)              # crop 1088 to 1080 lines
+           .u(1, 0).to_bytes())
+    PPS = (BitWriter().ue(0).ue(0).u(1, 1).u(1, 0).ue(0)  # pps_id, sps_id, CABAC
+           .ue(2).ue(0).u(1, 0).u(2, 0)                   # reference indexes, no weighted prediction
+           .se(0).se(0).se(0).u(1, 1).u(1, 0).u(1, 0)     # QP, deblocking control
+           .u(1, 1).u(1, 0).se(0).to_bytes())             # transform_8x8_mode
+
+    def start_gop(self, gop, first_frame, closed):
+        self.idr_pic_id = gop % 2
+
+    def write_frame(self, frame_type, frame, display, frame_size, closed):
+        header = BitWriter().u(3, H264_PRIMARY_PIC_TYPES[frame_type]).to_bytes()
+        self.f.write(_unit(H264_NAL_AUD, header, zero_byte=True))
+        if frame_type == 'I':
+            self.f.write(_unit(H264_NAL_SPS, self.SPS, zero_byte=True))
+            self.f.write(_unit(H264_NAL_PPS, self.PPS, zero_byte=True))
+        if frame_type == 'I':
+            nal = H264_NAL_IDR if closed else H264_NAL_REF_SLICE
+        else:
+            nal = H264_NAL_P_SLICE if frame_type == 'P' else H264_NAL_B_SLICE
+
+        def slice_header(n):
+            bits = (BitWriter().ue(n * WIDTH_MBS * HEIGHT_MBS // self.slices)
+                    .ue(H264_SLICE_TYPES[frame_type]).ue(0).u(4, frame))
+            if nal == H264_NAL_IDR:
+                bits.ue(self.idr_pic_id)
+            return _unit(nal, bits.u(6, 2 * display).to_bytes())
+
+        self.write_slices(frame_size, slice_header)
+
+
+class HEVCWriter(StreamWriter):
+    """
+    Annex B byte stream: every access unit opens with an AUD, I-frames also carry the VPS, SPS
+    and PPS. Closed GOPs start with an IDR picture whose leading B-frames are RADL pictures,
+    open GOPs with a CRA picture whose leading B-frames are RASL pictures.
+    The parameter sets only carry their ids, check_idr.py doesn't parse them.
+    """
+    codec = 'hevc'
+
+    VPS = BitWriter().u(4, 0).u(1, 1).u(1, 1).u(6, 0).u(3, 0).u(1, 1).to_bytes()
+    SPS = BitWriter().u(4, 0).u(3, 0).u(1, 1).ue(0).to_bytes()
+    PPS = BitWriter().ue(0).ue(0).to_bytes()
+
+    def _unit(self, nal_type: int, payload: bytes = b'', zero_byte: bool = False) -> bytes:
+        """Two-byte NAL header: nuh_layer_id 0, nuh_temporal_id_plus1 1."""
+        return _unit(nal_type << 1, b'\x01' + payload, zero_byte)
+
+    def start_gop(self, gop, first_frame, closed):
+        self.i_display = None
+
+    def write_frame(self, frame_type, frame, display, frame_size, closed):
+        self.f.write(self._unit(HEVC_NAL_AUD, BitWriter().u(3, 2).to_bytes(), zero_byte=True))
+        if frame_type == 'I':
+            # the I-frame is decoded first, B-frames displayed in front of it are its leading pictures
+            self.i_display = display
+            self.f.write(self._unit(HEVC_NAL_VPS, self.VPS, zero_byte=True))
+            self.f.write(self._unit(HEVC_NAL_SPS, self.SPS, zero_byte=True))
+            self.f.write(self._unit(HEVC_NAL_PPS, self.PPS, zero_byte=True))
+            if not closed:
+                nal = HEVC_NAL_CRA
+            else:
+                nal = HEVC_NAL_IDR_W_RADL if display > 0 else HEVC_NAL_IDR_N_LP
+        elif frame_type == 'P':
+            nal = HEVC_NAL_TRAIL_R
+        elif display < self.i_display:
+            nal = HEVC_NAL_RADL_N if closed else HEVC_NAL_RASL_N
+        else:
+            nal = HEVC_NAL_TRAIL_N
+
+        def slice_header(n):
+            bits = BitWriter().u(1, int(n == 0))                    # first_slice_segment_in_pic_flag
+            if nal >= HEVC_NAL_IDR_W_RADL:
+                bits.u(1, 0)                                        # no_output_of_prior_pics_flag
+            bits.ue(0)                                              # slice_pic_parameter_set_id
+            if n > 0:
+                bits.u(HEVC_CTB_ADDRESS_BITS, n * 30 * 17 // self.slices)
+            bits.ue(HEVC_SLICE_TYPES[frame_type])
+            if nal != HEVC_NAL_IDR_W_RADL and nal != HEVC_NAL_IDR_N_LP:
+                bits.u(8, display)                                  # slice_pic_order_cnt_lsb
+            return self._unit(nal, bits.to_bytes())
+
+        self.write_slices(frame_size, slice_header)
+
+
+class MPEG2Writer(StreamWriter):
+    """
+    Video elementary stream: every GOP repeats the sequence header and extension, every
+    picture carries a picture coding extension. Open and closed GOPs differ in closed_gop.
+    """
+    codec = 'mpeg2'
+
+    SEQUENCE_HEADER = (BitWriter().u(12, 1920).u(12, 1080).u(4, 3).u(4, 1)   # 16:9, 23.976 fps
+                       .u(18, 0x3FFFF).u(1, 1).u(10, 112).u(1, 0)           # bit rate, marker, vbv buffer
+                       .u(1, 0).u(1, 0).value.to_bytes(8, 'big'))
+    SEQUENCE_EXTENSION = (BitWriter().u(4, 1).u(8, 0x44).u(1, 1).u(2, 1)      # Main@High, progressive, 4:2:0
+                          .u(2, 0).u(2, 0).u(12, 0).u(1, 1).u(8, 0).u(1, 0)
+                          .u(2, 0).u(5, 0).value.to_bytes(6, 'big'))
+
+    def start_gop(self, gop, first_frame, closed):
+        self.f.write(_unit(0xB3, self.SEQUENCE_HEADER, zero_byte=True))
+        self.f.write(_unit(0xB5, self.SEQUENCE_EXTENSION))
+        seconds, pictures = divmod(first_frame, FRAME_RATE)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        time_code = BitWriter().u(1, 0).u(5, hours % 24).u(6, minutes).u(1, 1).u(6, seconds).u(6, pictures)
+        gop_header = time_code.u(1, int(closed)).u(1, 0).u(5, 0).value.to_bytes(4, 'big')
+        self.f.write(_unit(0xB8, gop_header))
+
+    def write_frame(self, frame_type, frame, display, frame_size, closed):
+        picture = BitWriter().u(10, display).u(3, MPEG2_CODING_TYPES[frame_type]).u(16, 0xFFFF)
+        if frame_type != 'I':
+            picture.u(4, 0b0111)                    # full_pel_forward_vector, forward_f_code
+        if frame_type == 'B':
+            picture.u(4, 0b0111)
+        self.f.write(_unit(0x00, picture.u(1, 0).to_bytes()))
+        coding_extension = (BitWriter().u(4, 8).u(16, 0xFFFF if frame_type == 'I' else 0x55FF)
+                            .u(2, 2).u(2, 3).u(1, 1).u(1, 1).u(1, 0).u(1, 1).u(1, 1)
+                            .u(1, 0).u(1, 0).u(1, 1).u(1, 1).u(1, 0).to_bytes())
+        self.f.write(_unit(0xB5, coding_extension))
+        # slice_vertical_position 1-68, spread over the macroblock rows
+        self.write_slices(frame_size, lambda n: _unit(1 + n * HEIGHT_MBS // self.slices,
+                                                      BitWriter().u(5, 8).u(1, 0).to_bytes()))
+
+
+class VC1Writer(StreamWriter):
+    """
+    Advanced Profile elementary stream: every GOP repeats the sequence header and opens with an
+    entry point header, whose CLOSED_ENTRY flag marks a closed GOP.
+    """
+    codec = 'vc1'
+
+    SEQUENCE_HEADER = (BitWriter().u(2, 3).u(3, 3).u(2, 1).u(3, 7).u(5, 31).u(1, 0)   # Advanced, level 3
+                       .u(12, 1920 // 2 - 1).u(12, 1080 // 2 - 1)                    # max coded size
+                       .u(1, 0).u(1, 0).u(1, 0).u(1, 0).u(1, 1).u(1, 0).u(1, 0).u(1, 0)
+                       .to_bytes())
+
+    def start_gop(self, gop, first_frame, closed):
+        self.f.write(_unit(0x0F, self.SEQUENCE_HEADER, zero_byte=True))
+        entry_point = (BitWriter().u(1, 0).u(1, int(closed)).u(1, 0).u(1, 0).u(1, 1).u(1, 0).u(1, 0)
+                       .u(2, 0).u(1, 1).u(1, 0).u(2, 0).u(1, 0).u(1, 0).u(1, 0).to_bytes())
+        self.f.write(_unit(0x0E, entry_point))
+
+    def write_frame(self, frame_type, frame, display, frame_size, closed):
+        bits, ptype = VC1_PTYPES[frame_type]
+        self.f.write(_unit(0x0D, BitWriter().u(bits, ptype).u(5, 8).to_bytes()))
+
+        def slice_header(n):
+            if n == 0:
+                # the frame header itself starts the first slice
+                return b''
+            return _unit(0x0B, BitWriter().u(9, n * HEIGHT_MBS // self.slices).u(1, 0).to_bytes())
+
+        self.write_slices(frame_size, slice_header)
+
+
+WRITERS = {
+    'h264': H264Writer,
+    'hevc': HEVCWriter,
+    'mpeg2': MPEG2Writer,
+    'vc1': VC1Writer,
+}
+
+
+def generate(codec, output, size: int, frame_size: int = DEFAULT_FRAME_SIZE, gop: str = DEFAULT_GOP,
+             open_gops: float = 0.0, slices: int = 1, payload: str = 'sparse', seed: int = 0):
+    """
+    Writes a synthetic stream of about size bytes to output, made of whole GOPs of the display
+    order pattern gop, and its ground truth to output.truth.json.
+    open_gops: fraction of GOPs after the first that are open, chosen at random.
+    Returns the ground truth: the KeyframeIndex check_idr.py should find, as a dict.
+    """
+    rng = random.Random(seed)
+    order = decode_order(gop)
+    weight = sum(FRAME_WEIGHTS[frame_type] for frame_type in gop) / len(gop)
+    gop_count = max(1, math.ceil(size / frame_size / len(gop)))
+
+    decode_frames = []
+    display_frames = []
+    offsets = []
+    frame = 0
+    with open(output, 'wb') as f, console.status("Writing GOP 1") as status:
+        writer = WRITERS[codec](f, slices, payload, rng)
+        for gop_number in range(gop_count):
+            closed = gop_number == 0 or rng.random() >= open_gops
+            # an HEVC CRA picture without leading pictures is a safe cut point even in an open GOP
+            if closed or (codec == 'hevc' and gop.startswith('I')):
+                # I-frame first in decode order, display index of the I-frame within the GOP
+                decode_frames.append(frame)
+                display_frames.append(frame + gop.index('I'))
+                offsets.append(f.tell())
+            writer.start_gop(gop_number, frame, closed)
+            for frame_type, display in order:
+                jitter = 1 + rng.uniform(-FRAME_SIZE_JITTER, FRAME_SIZE_JITTER)
+                writer.write_frame(frame_type, frame, display,
+                                   int(frame_size * FRAME_WEIGHTS[frame_type] / weight * jitter), closed)
+                frame += 1
+            if gop_number % 100 == 0:
+                status.update(f"Writing GOP {gop_number + 1}/{gop_count}")
+        # a stream ending in a hole still needs its full size
+        f.truncate()
+        size = f.tell()
+
+    # H.264 and VC-1 frames are numbered in decode order by check_idr.py
+    if codec in ('h264', 'vc1'):
+        display_frames = list(decode_frames)
+    truth = {
+        'codec': codec,
+        'size': size,
+        'frame_count': frame,
+        'gop': gop,
+        'open_gops': open_gops,
+        'slices': slices,
+        'payload': payload,
+        'seed': seed,
+        'decode_frames': decode_frames,
+        'display_frames': display_frames,
+        'offsets': offsets,
+    }
+    with open(str(output) + TRUTH_SUFFIX, 'w') as f:
+        json.dump(truth, f)
+    return truth
+
+
+def _compare(truth, index: check_idr.KeyframeIndex):
+    """
+    Returns None if index matches the ground truth, or a description of the first difference.
+    """
+    if index.frame_count != truth['frame_count']:
+        return f"{index.frame_count} frames, expected {truth['frame_count']}"
+    expected = list(zip(truth['decode_frames'], truth['display_frames'], truth['offsets']))
+    found = list(zip(index.decode_frames, index.display_frames, index.offsets))
+    for expected_frame, found_frame in zip(expected, found):
+        if expected_frame != found_frame:
+            return f"found {found_frame}, expected {expected_frame} (decode, display, offset)"
+    if len(found) != len(expected):
+        return f"{len(found)} keyframes, expected {len(expected)}"
+    return None
+
+
+@contextlib.contextmanager
+def _removed(path: Path):
+    """
+    Removes a sidecar file before and after the block, so every run starts without it.
+    """
+    path.unlink(missing_ok=True)
+    try:
+        yield
+    finally:
+        path.unlink(missing_ok=True)
+
+
+def _check_queries(video_file, truth, queries: int, rng: random.Random):
+    """
+    Checks random frames the way check_idr.py --no-index does, which stops scanning after the
+    target, against the ground truth. Returns (queries passed, description of the first failure).
+    """
+    index = check_idr.KeyframeIndex(truth['codec'], truth['frame_count'], truth['decode_frames'],
+                                    truth['display_frames'], truth['offsets'])
+    find = check_idr.FIND_FUNCTIONS[truth['codec']]
+    frame_map = Path(str(video_file) + check_idr.FRAME_MAP_SUFFIX)
+    passed = 0
+    failure = None
+    with _removed(frame_map):
+        for _ in range(queries):
+            target = rng.randrange(truth['frame_count'])
+            check = find(str(video_file), target, False, use_index=False, quiet=True).checks[0]
+            expected = check_idr.FrameCheck(target, *check_idr._nearest_keyframes(index, target))
+            if check == expected:
+                passed += 1
+            elif failure is None:
+                failure = f"frame {target}: {check}, expected {expected}"
+    return passed, failure
+
+
+def bench(video_files, jobs_list, repeat: int = 1, queries: int = 0, seed: int = 0):
+    """
+    Scans every stream with each number of jobs, best of repeat runs, and checks the keyframe
+    index found against the ground truth of the stream.
+    Returns one result dict per stream and jobs value.
+    """
+    rng = random.Random(seed)
+    results = []
+    for video_file in video_files:
+        truth_file = Path(str(video_file) + TRUTH_SUFFIX)
+        if not truth_file.exists():
+            console.print(f"[yellow]{video_file} has no {TRUTH_SUFFIX} ground truth, skipped[/]")
+            continue
+        with open(truth_file) as f:
+            truth = json.load(f)
+        for run, jobs in enumerate(jobs_list):
+            best = None
+            mismatch = None
+            for _ in range(repeat):
+                with console.status(f"Scanning {Path(video_file).name} with {jobs} jobs"):
+                    index, stats = check_idr._scan_stream(video_file, truth['codec'], None, None, jobs)
+                mismatch = mismatch or _compare(truth, index)
+                if best is None or stats.scan_time < best.scan_time:
+                    best = stats
+            result = {'file': str(video_file), 'codec': truth['codec'], 'size': truth['size'], 'jobs': jobs,
+                      'keyframes': len(truth['decode_frames']), 'mismatch': mismatch, **best.to_dict()}
+            # the early-stop scans don't use --jobs, check them once per stream
+            if queries and run == 0:
+                start_time = time.perf_counter()
+                with console.status(f"Checking {queries} frames of {Path(video_file).name}"):
+                    passed, failure = _check_queries(video_file, truth, queries, rng)
+                result.update(queries=queries, queries_passed=passed, query_failure=failure,
+                              query_time=round((time.perf_counter() - start_time) / queries, 6))
+            results.append(result)
+    return results
+
+
+def _print_results(results):
+    """
+    Prints one row per stream and jobs value.
+    """
+    table = Table()
+    table.add_column("File")
+    table.add_column("Codec")
+    table.add_column("Size", justify="right")
+    table.add_column("Jobs", justify="right")
+    table.add_column("Time", justify="right")
+    table.add_column("MB/s", justify="right")
+    table.add_column("Frames/s", justify="right")
+    table.add_column("Keyframes", justify="right")
+    table.add_column("Index")
+    table.add_column("Queries")
+    for result in results:
+        queries = ""
+        if 'queries' in result:
+            color = "green" if result['queries_passed'] == result['queries'] else "red"
+            queries = f"[{color}]{result['queries_passed']}/{result['queries']}[/] ({result['query_time']:.3f}s each)"
+        table.add_row(Path(result['file']).name, result['codec'], f"{result['size'] / 1e6:.0f} MB", str(result['jobs']),
+                      f"{result['scan_time']:.3f}s", f"{result['mb_per_s'] or 0:.1f}", f"{result['frames_per_s'] or 0:.0f}",
+                      str(result['keyframes']),
+                      "[green]ok[/]" if result['mismatch'] is None else f"[red]{result['mismatch']}[/]", queries)
+    console.print(table)
+    for result in results:
+        if result.get('query_failure'):
+            console.print(f"[red]{Path(result['file']).name} {result['query_failure']}[/]")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate synthetic H.264/HEVC/MPEG-2/VC-1 streams and benchmark the check_idr.py scanners on them.',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='''
+            Usage:
+            bench_check_idr.py generate h264 synthetic.h264 --size 2G
+            bench_check_idr.py generate hevc radl.hevc --size 500M --gop BBIBBPBBPBBP --open-gops 0.2
+            bench_check_idr.py generate mpeg2 open.m2v --size 500M --gop BBIBBPBBPBBPBBP --open-gops 0.5
+            bench_check_idr.py generate vc1 big.vc1 --size 40G --frame-size 256K --slices 4
+            bench_check_idr.py generate h264 random.h264 --size 1G --payload random
+            bench_check_idr.py bench synthetic.h264 open.m2v big.vc1
+            bench_check_idr.py bench synthetic.h264 --jobs 1 --jobs 8 --repeat 3 --queries 50
+        '''
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = commands.add_parser('generate', help='Write a synthetic stream and its ground truth')
+    generate_parser.add_argument('codec', choices=sorted(WRITERS))
+    generate_parser.add_argument('output', nargs='?',
+                                 help='Path of the stream (default: synthetic.<ext> in the current directory)')
+    generate_parser.add_argument('--size', type=parse_size, default=parse_size('100M'),
+                                 help='Approximate size of the stream, e.g. 500M or 40G (default: 100M)')
+    generate_parser.add_argument('--frame-size', type=parse_size, default=DEFAULT_FRAME_SIZE,
+                                 help=f'Average frame size (default: {DEFAULT_FRAME_SIZE // 1024}K)')
+    generate_parser.add_argument('--gop', type=gop_pattern, default=DEFAULT_GOP,
+                                 help=f'GOP pattern in display order, with exactly one I-frame (default: {DEFAULT_GOP})')
+    generate_parser.add_argument('--open-gops', type=float, default=0.0,
+                                 help='Fraction of GOPs after the first that are open, i.e. not safe cut points (default: 0)')
+    generate_parser.add_argument('--slices', type=int, default=1,
+                                 help='Slices per frame (default: 1)')
+    generate_parser.add_argument('--payload', choices=('sparse', 'random'), default='sparse',
+                                 help='Leave the frame payload as holes of a sparse file, or fill it with random bytes (default: sparse)')
+    generate_parser.add_argument('--seed', type=int, default=0,
+                                 help='Seed of the frame sizes, open GOPs and random payload (default: 0)')
+
+    bench_parser = commands.add_parser('bench', help='Scan generated streams and check the results against their ground truth')
+    bench_parser.add_argument('video_files', nargs='+', metavar='video_file',
+                              help='Streams written by generate')
+    bench_parser.add_argument('-j', '--jobs', type=int, action='append',
+                              help='Number of scanning processes, can be given multiple times to compare (default: 1)')
+    bench_parser.add_argument('--repeat', type=int, default=1,
+                              help='Scans per stream and jobs value, the fastest is reported (default: 1)')
+    bench_parser.add_argument('--queries', type=int, default=0,
+                              help='Also check this many random frames with early-stopping --no-index scans (default: 0)')
+    bench_parser.add_argument('--seed', type=int, default=0,
+                              help='Seed of the random --queries frames (default: 0)')
+    bench_parser.add_argument('--json', action='store_true',
+                              help='Print the results as JSON')
+
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        if args.slices < 1 or not 0 <= args.open_gops <= 1 or args.frame_size <= 0:
+            console.print("[red]--slices must be at least 1, --open-gops between 0 and 1 and --frame-size positive[/]")
+            sys.exit(1)
+        if args.payload == 'random' and args.frame_size * FRAME_WEIGHTS['I'] * 2 > RANDOM_BLOCK_SIZE:
+            console.print(f"[red]--payload random supports frames up to {RANDOM_BLOCK_SIZE // 8 // 1024}K[/]")
+            sys.exit(1)
+        output = args.output or f"synthetic{EXTENSIONS[args.codec]}"
+        start_time = time.time()
+        truth = generate(args.codec, output, args.size, args.frame_size, args.gop, args.open_gops,
+                         args.slices, args.payload, args.seed)
+        console.print(f"Wrote [green]{output}[/]: {truth['size'] / 1e6:.1f} MB, {truth['frame_count']} frames, "
+                      f"{len(truth['decode_frames'])} safe cut frames in {time.time() - start_time:.1f} seconds")
+        return
+
+    jobs_list = args.jobs or [1]
+    if any(jobs < 1 for jobs in jobs_list) or args.repeat < 1 or args.queries < 0:
+        console.print("[red]--jobs and --repeat must be at least 1, --queries non-negative[/]")
+        sys.exit(1)
+    if args.json:
+        console.stderr = True
+    results = bench(args.video_files, jobs_list, args.repeat, args.queries, args.seed)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        _print_results(results)
+    if any(result['mismatch'] or result.get('query_failure') for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,293 +1,997 @@
 """
 Dependencies:
 pip install rich av
-ffmpeg https://www.ffmpeg.org/download.html
-Ensure ffmpeg is in PATH.
 
-@version 2.3
+@version 3.10
 
-Video codecs supported: H.264, MPEG-2, VC-1
+Video codecs supported: H.264, HEVC, MPEG-2, VC-1
 """
 import argparse
+import bisect
+import cProfile
+import hashlib
+import json
+import mmap
+import os
+import pstats
 import re
-import subprocess
+import socketserver
+import struct
 import sys
+import threading
 import time
 import contextlib
+import errno
+import xml.etree.ElementTree as ET
 
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from fractions import Fraction
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+from typing import List, NamedTuple, Optional, Tuple
 
 import av
 from rich.console import Console
+from rich.table import Table
 
 console = Console(color_system="truecolor")
 
-def find_idr_frames(video_file, target_frame, verbose: bool):
+# 3-byte start code prefix shared by H.264 Annex B, MPEG-2 and VC-1 elementary streams
+START_CODE = b'\x00\x00\x01'
+
+# H.264 nal_unit_type values (ITU-T H.264 Table 7-1)
+H264_NAL_SLICE = 1
+H264_NAL_IDR_SLICE = 5
+# AUD, SPS, PPS, SEI and 14-18, the NALs that may open an access unit
+H264_AU_START_NALS = frozenset({6, 7, 8, 9, 14, 15, 16, 17, 18})
+# first slice (first_mb_in_slice = 0) of a non-IDR or IDR picture with any nal_ref_idc,
+# i.e. the start of every frame, used to count frames without visiting each NAL
+H264_FIRST_SLICE = re.compile(rb'\x00\x00\x01[\x01\x21\x41\x61\x05\x25\x45\x65][\x80-\xff]')
+# frames in front of the last target that are inspected NAL by NAL instead of only counted
+H264_INSPECT_WINDOW = 250
+
+# HEVC nal_unit_type values (ITU-T H.265 Table 7-1)
+HEVC_NAL_RADL_N = 6         # 6-7: random access decodable leading pictures
+HEVC_NAL_RASL_N = 8         # 8-9: random access skipped leading pictures
+HEVC_NAL_RASL_R = 9
+HEVC_NAL_BLA_W_LP = 16      # 16-18: broken link access
+HEVC_NAL_IDR_W_RADL = 19    # 19-20: instantaneous decoding refresh
+HEVC_NAL_IDR_N_LP = 20
+HEVC_NAL_CRA = 21           # clean random access
+HEVC_NAL_IRAP_END = 23      # 22-23 are reserved IRAP types
+# VPS, SPS, PPS, AUD, prefix SEI and reserved 41-44/48-55, the NALs that may open an access unit
+HEVC_AU_START_NALS = frozenset({32, 33, 34, 35, 39, 41, 42, 43, 44, 48, 49, 50, 51, 52, 53, 54, 55})
+
+# MPEG-2 video start codes (ISO/IEC 13818-2 Table 6-1)
+MPEG2_PICTURE_START_CODE = b'\x00\x00\x01\x00'
+MPEG2_GOP_START_CODE = b'\x00\x00\x01\xb8'
+MPEG2_SEQUENCE_START_CODE = b'\x00\x00\x01\xb3'
+MPEG2_SEQUENCE_SUFFIXES = frozenset({0xB2, 0xB5})   # user data and extensions may follow a sequence header
+
+# VC-1 Advanced Profile start code suffixes (SMPTE 421M Annex E)
+VC1_SC_FRAME = 0x0D
+VC1_SC_ENTRYPOINT = 0x0E
+VC1_ENTRYPOINT_START_CODE = b'\x00\x00\x01\x0e'
+VC1_SEQUENCE_START_CODE = b'\x00\x00\x01\x0f'
+VC1_SEQUENCE_SUFFIXES = frozenset({0x1F})           # sequence level user data
+
+# PyAV format names of the raw elementary streams scanned directly, anything else is demuxed
+RAW_STREAM_FORMATS = ("h264", "hevc", "mpegvideo", "vc1")
+# PyAV codec name -> scanner codec
+STREAM_CODECS = {
+    'h264': 'h264',
+    'hevc': 'hevc',
+    'mpeg1video': 'mpeg2',
+    'mpeg2video': 'mpeg2',
+    'vc1': 'vc1',
+}
+
+# smallest byte range worth handing to a separate process with --jobs
+PARALLEL_MIN_RANGE = 64 * 1024 * 1024
+
+# keyframe index sidecar, stored as <video_file>.kfindex
+INDEX_SUFFIX = '.kfindex'
+INDEX_MAGIC = b'KFIX'
+INDEX_VERSION = 2
+# magic, version, codec, stream size, stream mtime (ns), frame count, keyframe count, path length
+INDEX_HEADER = struct.Struct('<4sH8sQqqQH')
+
+# coarse frame -> byte offset map of H.264 streams left by --no-index scans, stored as <video_file>.kfmap
+FRAME_MAP_SUFFIX = '.kfmap'
+FRAME_MAP_MAGIC = b'KFMP'
+FRAME_MAP_VERSION = 1
+# frames between two resume points of the frame map
+FRAME_MAP_STEP = 1000
+
+# functions listed in the cProfile section of --profile, by cumulative time
+PROFILE_TOP_FUNCTIONS = 25
+
+# --serve defaults: localhost HTTP port and number of keyframe indexes held in memory
+SERVE_PORT = 8765
+SERVE_CACHE_SIZE = 32
+# Host and Origin names of --serve HTTP requests from this machine, anything else is refused
+LOOPBACK_HOSTS = frozenset({'127.0.0.1', 'localhost', '::1'})
+
+# read size of --split-at when the kernel can't copy between the two files itself
+SPLIT_BUFFER_SIZE = 1 << 20
+# errors of copy_file_range/sendfile that mean "not between these files", not a failed copy
+KERNEL_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF, errno.EPERM}
+
+# --fps values that are shorthand for the NTSC rates, 23.976 itself would drift by a frame over a film
+NTSC_FRAME_RATES = {
+    '23.976': Fraction(24000, 1001),
+    '29.97': Fraction(30000, 1001),
+    '47.952': Fraction(48000, 1001),
+    '59.94': Fraction(60000, 1001),
+    '119.88': Fraction(120000, 1001),
+}
+# Matroska chapters XML elements holding timestamps
+CHAPTER_TIME_TAGS = ('ChapterTimeStart', 'ChapterTimeEnd')
+# XML declaration, DOCTYPE and comments in front of the root element of a chapters XML
+XML_PROLOG = re.compile(r'\s*(?:<\?.*?\?>\s*|<!--.*?-->\s*|<!DOCTYPE(?:[^>\[]|\[.*?\])*>\s*)*', re.DOTALL)
+# snapped chapters moved further than this many seconds are reported
+CHAPTER_SHIFT_WARNING = 2.0
+# timestamp at the start of a chapter list line, optionally in OGM CHAPTER01=00:00:00.000 form
+CHAPTER_LINE = re.compile(r'^(\s*(?:CHAPTER\d+=)?)(\d+(?::\d+){0,2}(?:\.\d+)?)(\s.*)?$')
+
+
+class KeyframeIndex(NamedTuple):
     """
-    Determines whether the target frame is and IDR frame. If not, find the nearest bi-directional IDR frames.
-    video_file: Path to the H.264 video file.
-    target_frame: Frame number to check.
+    Every safe cut frame found in a stream.
+    decode_frames, display_frames and offsets are parallel lists in decode order. Safe cut frames
+    are never reordered against each other, so display_frames is sorted as well.
+    offsets holds the byte offset the stream can be cut at in front of each safe cut frame.
+    """
+    codec: str
+    frame_count: int
+    decode_frames: List[int]
+    display_frames: List[int]
+    offsets: List[int]
+
+
+class FrameMap(NamedTuple):
+    """
+    Points an H.264 scan can resume from, left by earlier early-stop scans.
+    frames, offsets and idr are parallel lists sorted by frame. Scanning from offset counts
+    the frame as its first frame. IDR points are the byte offset of the IDR access unit, the
+    others the start code of a frame's first slice. Every IDR frame below frame_count is a point.
+    """
+    frame_count: int
+    frames: List[int]
+    offsets: List[int]
+    idr: List[int]
+
+
+class ScanStats(NamedTuple):
+    """
+    Work done by a scan, as reported by --profile.
+    units_inspected counts the start codes (elementary streams) or packets (containers) looked at
+    from Python, frames_scanned the frames counted on the way.
+    scan_time is the wall time of the whole scan, busy_time the wall time summed over every process
+    that scanned and parse_time the CPU time of those processes. For a playlist, scan_time is the sum
+    of the scan times of its segments, which overlap when they are indexed in parallel.
+    wait_time, the rest of busy_time, is time the scanning processes were not running on a CPU:
+    waiting for the stream to be paged in or read from disk, but also waiting for a CPU when there
+    are more --jobs than cores. It only measures I/O when every process has a core to itself.
+    """
+    bytes_scanned: int = 0
+    units_inspected: int = 0
+    frames_scanned: int = 0
+    scan_time: float = 0.0
+    busy_time: float = 0.0
+    parse_time: float = 0.0
+
+    def add(self, other: 'ScanStats') -> 'ScanStats':
+        return ScanStats(*(a + b for a, b in zip(self, other)))
+
+    def to_dict(self):
+        """
+        JSON serializable form of the stats with throughput figures, as written by --profile.
+        """
+        def rate(amount):
+            return round(amount / self.scan_time, 3) if self.scan_time > 0 else None
+
+        return {
+            'bytes_scanned': self.bytes_scanned,
+            'units_inspected': self.units_inspected,
+            'frames_scanned': self.frames_scanned,
+            'scan_time': round(self.scan_time, 6),
+            'mb_per_s': rate(self.bytes_scanned / 1e6),
+            'frames_per_s': rate(self.frames_scanned),
+            'units_per_s': rate(self.units_inspected),
+            'busy_time': round(self.busy_time, 6),
+            'parse_time': round(self.parse_time, 6),
+            'wait_time': round(max(0.0, self.busy_time - self.parse_time), 6),
+        }
+
+
+class StreamInfo(NamedTuple):
+    """
+    What detect_stream found in a file.
+    codec is the scanner codec (h264, hevc, mpeg2 or vc1), container is True for anything
+    that isn't a raw elementary stream. frame_rate is the average frame rate the container
+    declares, None for raw streams where it would only be a guess.
+    """
+    codec: str
+    container: bool
+    format_name: str
+    codec_name: str
+    profile: Optional[str]
+    frame_rate: Optional[Fraction] = None
+
+
+class ChapterFile(NamedTuple):
+    """
+    Chapter timestamps read by _read_chapters, in file order.
+    tree is the parsed Matroska chapters XML, or None for a plain timestamp list, whose lines are
+    kept as read. prolog is the XML declaration, DOCTYPE and comments in front of the root element.
+    digits is the number of decimals each timestamp is written back with, starts whether it is the
+    start of a chapter rather than a ChapterTimeEnd.
+    """
+    path: str
+    tree: Optional[ET.ElementTree]
+    lines: List[str]
+    times: List[Fraction]
+    digits: List[int]
+    prolog: str = ''
+    starts: Optional[List[bool]] = None
+
+
+class FrameCheck(NamedTuple):
+    """
+    Status of a single target frame. before and after are the nearest
+    (decode_frame, display_frame) safe cut frames on either side of it, or None.
+    """
+    target: int
+    is_safe: bool
+    before: Optional[Tuple[int, int]]
+    after: Optional[Tuple[int, int]]
+
+
+class ScanResult(NamedTuple):
+    """
+    Result returned by the find_* functions and check_frames.
+    index holds every safe cut frame found. If the scan was stopped early (use_index=False)
+    it only reaches the first safe cut frame after the last target. bytes_scanned is 0
+    when the answer came from the keyframe index.
+    """
+    video_file: str
+    codec: str
+    checks: List[FrameCheck]
+    index: KeyframeIndex
+    bytes_scanned: int
+    elapsed: float
+    from_index: bool
+    stats: ScanStats = ScanStats()
+
+    def to_dict(self, keyframes: bool = True):
+        """
+        JSON serializable form of the result, as printed by --json.
+        keyframes: include the full list of safe cut frames found.
+        """
+        def keyframe(frame):
+            return None if frame is None else {'decode': frame[0], 'display': frame[1]}
+
+        result = {
+            'file': self.video_file,
+            'codec': self.codec,
+            'frame_count': self.index.frame_count,
+            'from_index': self.from_index,
+            'bytes_scanned': self.bytes_scanned,
+            'elapsed': round(self.elapsed, 6),
+            'targets': [
+                {'frame': check.target, 'is_safe': check.is_safe,
+                 'before': keyframe(check.before), 'after': keyframe(check.after)}
+                for check in self.checks
+            ],
+        }
+        if keyframes:
+            result['keyframes'] = {
+                'decode': self.index.decode_frames,
+                'display': self.index.display_frames,
+                'offsets': self.index.offsets,
+            }
+        return result
+
+
+class PlaylistResult(NamedTuple):
+    """
+    Result returned by find_playlist_frames and check_playlist for segments played back to back.
+    Frame numbers in checks and index count from the first frame of the first segment.
+    frame_bases holds the timeline frame number of the first frame of each segment. The offsets
+    in index are byte offsets within the segment file its parallel segments entry points to.
+    """
+    video_files: List[str]
+    codec: str
+    frame_bases: List[int]
+    checks: List[FrameCheck]
+    index: KeyframeIndex
+    segments: List[int]
+    bytes_scanned: int
+    elapsed: float
+    stats: ScanStats = ScanStats()
+
+    def locate(self, frame):
+        """
+        (segment, frame within the segment) of a timeline frame number.
+        """
+        segment = max(0, bisect.bisect_right(self.frame_bases, frame) - 1)
+        return segment, frame - self.frame_bases[segment]
+
+    def to_dict(self):
+        """
+        JSON serializable form of the result, as printed by --json.
+        """
+        def keyframe(frame):
+            if frame is None:
+                return None
+            segment, segment_frame = self.locate(frame[1])
+            return {'decode': frame[0], 'display': frame[1], 'segment': segment, 'segment_frame': segment_frame}
+
+        frame_ends = self.frame_bases[1:] + [self.index.frame_count]
+        targets = []
+        for check in self.checks:
+            segment, segment_frame = self.locate(check.target)
+            targets.append({'frame': check.target, 'segment': segment, 'segment_frame': segment_frame,
+                            'is_safe': check.is_safe, 'before': keyframe(check.before), 'after': keyframe(check.after)})
+        return {
+            'files': self.video_files,
+            'codec': self.codec,
+            'frame_count': self.index.frame_count,
+            'segments': [
+                {'file': video_file, 'first_frame': first_frame, 'frame_count': frame_end - first_frame}
+                for video_file, first_frame, frame_end in zip(self.video_files, self.frame_bases, frame_ends)
+            ],
+            'bytes_scanned': self.bytes_scanned,
+            'elapsed': round(self.elapsed, 6),
+            'targets': targets,
+            'keyframes': {
+                'decode': self.index.decode_frames,
+                'display': self.index.display_frames,
+                'segment': self.segments,
+                'offsets': self.index.offsets,
+            },
+        }
+
+
+@contextlib.contextmanager
+def _map_stream(video_file):
+    """
+    Memory-maps a raw stream read-only so start codes can be searched without
+    copying the file through Python in chunks.
+    """
+    with open(video_file, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+def _iter_start_codes(buf, start=0, end=None):
+    """
+    Yields the offset of every 0x00 0x00 0x01 start code prefix in buf[start:end].
+    The search itself runs in C (mmap.find), so the Python loop only ever visits
+    start codes instead of every byte of the stream.
+    A 4-byte start code (0x00 0x00 0x00 0x01) is reported at the offset of its last 3 bytes.
+    """
+    if end is None:
+        end = len(buf)
+    find = buf.find
+    pos = find(START_CODE, start, end)
+    while pos != -1:
+        yield pos
+        pos = find(START_CODE, pos + 3, end)
+
+
+def _index_paths(video_file, suffix: str = INDEX_SUFFIX):
+    """
+    Locations the keyframe index (or another sidecar with the given suffix) of video_file may be
+    stored at, in order of preference: a sidecar next to the stream, then the user cache directory
+    for streams on read-only media.
+    """
+    video_file = Path(video_file).resolve()
+    cache_dir = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'check_idr'
+    digest = hashlib.sha1(str(video_file).encode('utf-8')).hexdigest()
+    return [video_file.with_name(video_file.name + suffix), cache_dir / (digest + suffix)]
+
+
+def _read_sidecar(video_file, suffix, magic, version, codec):
+    """
+    Loads a sidecar written by _write_sidecar.
+    Returns (frame_count, columns), or None if there is no sidecar or if it was built for a
+    different path, size or mtime.
     """
-    start_time = time.time()
-    # run ffmpeg trace_headers
-    cmd = ['ffmpeg', '-i', str(video_file), '-c', 'copy', '-bsf:v', 'trace_headers', '-f', 'null', '-']
-    
-    try:
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
-    except FileNotFoundError as fe:
-        console.print(f"[red]{video_file} or ffmpeg not found, ensure ffmpeg is in PATH[/]")
-        sys.exit(1)
-    except Exception as e:
-        console.print(f"[red]Error running ffmpeg:[/] {e}")
-        sys.exit(1)
-    
-    status_ctx = console.status("Starting scan...", spinner="dots") if verbose else contextlib.nullcontext()
-    
-    idr_frames = set()
-    current_frame = -1
-    in_slice_header = False
-    idr_before = None
-    idr_after = None
-    target_is_idr = False
-    
-    # parse h264 bitstream headers
     try:
-        with status_ctx as status:
-            for line in process.stdout:
-                # remove unneeded line content
-                match = re.match(r'\[.*?\]\s+(.*)', line)
-                if not match:
-                    continue
-                
-                content = match.group(1).strip().lower()
-                
-                # check for new frame, denoted by access unit delimiter
-                if content == "access unit delimiter":
-                    current_frame += 1
-                    in_slice_header = False
-                    
-                    if verbose and status is not None:
-                        status.update(f"Scanning frame {current_frame}")
-                    
-                    # if we've found an IDR frame after the target, stop
-                    if idr_after is not None:
-                        process.terminate()
-                        break
-                    
+        stat = os.stat(video_file)
+    except OSError:
+        return None
+    path = str(Path(video_file).resolve()).encode('utf-8')
+
+    for sidecar_path in _index_paths(video_file, suffix):
+        try:
+            with open(sidecar_path, 'rb') as f:
+                header = f.read(INDEX_HEADER.size)
+                if len(header) != INDEX_HEADER.size:
                     continue
-                
-                # check for slice header
-                if content == "slice header":
-                    in_slice_header = True
+                file_magic, file_version, file_codec, size, mtime_ns, frame_count, count, path_len = INDEX_HEADER.unpack(header)
+                if (file_magic != magic or file_version != version
+                        or file_codec.rstrip(b'\x00') != codec.encode()
+                        or size != stat.st_size or mtime_ns != stat.st_mtime_ns
+                        or f.read(path_len) != path):
                     continue
-                
-                # check if frame is IDR, denoted by slice header having nal_unit_type = 5
-                if in_slice_header and "nal_unit_type" in content:
-                    parts = content.split('=')
-                    if len(parts) >= 2:
-                        nal_type = parts[-1].strip()
-                        if nal_type == '5':
-                            if current_frame == target_frame:
-                                # success, target frame as IDR, stop
-                                target_is_idr = True
-                                idr_frames.add(current_frame)
-                                process.terminate()
-                                break
-                            elif current_frame < target_frame:
-                                idr_before = current_frame
-                                idr_frames.add(current_frame)
-                            elif current_frame > target_frame and idr_after is None:
-                                idr_after = current_frame
-                                idr_frames.add(current_frame)
-    finally:
-        process.wait()
-    
-    end_time = time.time()
-    elapsed_time = end_time - start_time
-    console.print(f"\nExecution time: [blue]{elapsed_time:.3f}[/] seconds")
-    
-    if target_is_idr:
-        console.print(f"[green]Frame {target_frame} is an IDR frame[/]")
-    else:
-        console.print(f"[yellow]Frame {target_frame} is NOT an IDR frame[/]")
+                values = array('q')
+                values.fromfile(f, 3 * count)
+        except (OSError, EOFError):
+            continue
 
-    if idr_before is not None:
-        console.print(f"Nearest IDR frame before target: [green]{idr_before}[/]")
-    else:
-        console.print("No IDR frame found before the target frame")
-    
-    if idr_after is not None:
-        console.print(f"Nearest IDR frame after target: [green]{idr_after}[/]")
-    else:
-        console.print("No IDR frame found after the target frame")
-        
-    if verbose:
-        console.print(f"All IDR frames found: [green]{sorted(idr_frames)}[/]")
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return frame_count, [values[:count].tolist(), values[count:2*count].tolist(), values[2*count:].tolist()]
+    return None
 
 
-def find_safe_frames_mpeg2(video_file, target_frame, verbose: bool):
+def _write_sidecar(video_file, suffix, magic, version, codec, frame_count, columns):
     """
-    Determines whether the target frame is a closed GOP I-frame.
-    If not, find the nearest bi-directional closed GOP I-frames.
-    video_file: Path to the MPEG-2 video file.
-    target_frame: Frame number to check.
+    Stores three equally long integer columns for video_file, keyed by its path, size and mtime.
+    Returns the path written to, or None if no sidecar location was writable.
     """
-    start_time = time.time()
-    cmd = ['ffmpeg', '-i', str(video_file), '-c', 'copy', '-bsf:v', 'trace_headers', '-f', 'null', '-']
- 
+    stat = os.stat(video_file)
+    path = str(Path(video_file).resolve()).encode('utf-8')
+    header = INDEX_HEADER.pack(magic, version, codec.encode(), stat.st_size,
+                               stat.st_mtime_ns, frame_count, len(columns[0]), len(path))
+    values = array('q', columns[0] + columns[1] + columns[2])
+    if sys.byteorder == 'big':
+        values.byteswap()
+
+    for sidecar_path in _index_paths(video_file, suffix):
+        try:
+            sidecar_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(sidecar_path, 'wb') as f:
+                f.write(header)
+                f.write(path)
+                values.tofile(f)
+        except OSError:
+            continue
+        return sidecar_path
+    return None
+
+
+def _read_index(video_file, codec) -> Optional[KeyframeIndex]:
+    """
+    Loads the keyframe index of video_file.
+    Returns None if there is no index or if it was built for a different path, size or mtime.
+    """
+    sidecar = _read_sidecar(video_file, INDEX_SUFFIX, INDEX_MAGIC, INDEX_VERSION, codec)
+    if sidecar is None:
+        return None
+    frame_count, (decode_frames, display_frames, offsets) = sidecar
+    return KeyframeIndex(codec, frame_count, decode_frames, display_frames, offsets)
+
+
+def _write_index(video_file, index: KeyframeIndex):
+    """
+    Stores the keyframe index of video_file.
+    Returns the path written to, or None if no index location was writable.
+    """
+    return _write_sidecar(video_file, INDEX_SUFFIX, INDEX_MAGIC, INDEX_VERSION, index.codec, index.frame_count,
+                          [index.decode_frames, index.display_frames, index.offsets])
+
+
+def _read_frame_map(video_file) -> Optional[FrameMap]:
+    """
+    Loads the H.264 frame map of video_file, or None if there is no matching one.
+    """
+    sidecar = _read_sidecar(video_file, FRAME_MAP_SUFFIX, FRAME_MAP_MAGIC, FRAME_MAP_VERSION, 'h264')
+    if sidecar is None:
+        return None
+    return FrameMap(sidecar[0], *sidecar[1])
+
+
+def _write_frame_map(video_file, frame_map: FrameMap):
+    """
+    Stores the H.264 frame map of video_file.
+    """
+    return _write_sidecar(video_file, FRAME_MAP_SUFFIX, FRAME_MAP_MAGIC, FRAME_MAP_VERSION, 'h264',
+                          frame_map.frame_count, [frame_map.frames, frame_map.offsets, frame_map.idr])
+
+
+def _load_keyframes(video_file, codec, last_target, verbose: bool, use_index: bool, jobs: int = 1,
+                    container: bool = False,
+                    inspect_window: int = H264_INSPECT_WINDOW) -> Tuple[KeyframeIndex, ScanStats, bool]:
+    """
+    Returns the KeyframeIndex of video_file, read from its index when one matches the file.
+    Otherwise the stream is scanned. With use_index the whole stream is scanned (by `jobs`
+    processes) and the index is saved for later queries, without it the scan stops at the
+    first safe cut frame after last_target.
+    Also returns the ScanStats of the scan and whether the index was read from disk.
+    """
+    if use_index:
+        index = _read_index(video_file, codec)
+        if index is not None:
+            if verbose:
+                console.print("Using keyframe index")
+            return index, ScanStats(), True
+
+    status_ctx = console.status("Starting scan...", spinner="dots") if verbose else contextlib.nullcontext()
+
     try:
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+        with status_ctx as status:
+            index, stats = _scan_stream(video_file, codec, None if use_index else last_target, status, jobs,
+                                        container, inspect_window)
     except FileNotFoundError:
-        console.print(f"[red]{video_file} or ffmpeg not found, ensure ffmpeg is in PATH[/]")
+        console.print(f"[red]{video_file} not found[/]")
         sys.exit(1)
     except Exception as e:
-        console.print(f"[red]Error running ffmpeg:[/] {e}")
+        console.print(f"[red]Error reading {video_file}:[/] {e}")
         sys.exit(1)
- 
-    status_ctx = console.status("Starting scan...", spinner="dots") if verbose else contextlib.nullcontext()
- 
-    safe_cut_frames = set()   # closed GOP I-frames
-    all_i_frames = set()      # every I-frame regardless of GOP type
-    in_picture_header = False
-    in_gop_header = False
+
+    if use_index and _write_index(video_file, index) is None:
+        console.print("[yellow]Could not write the keyframe index, the next query will rescan the stream[/]")
+    return index, stats, False
+
+
+def _nearest_keyframes(index: KeyframeIndex, target_frame):
+    """
+    Bisects the keyframe index for target_frame (display order).
+    Returns (target_is_safe, before, after) where before and after are the nearest
+    (decode_frame, display_frame) safe cut frames on either side of the target, or None.
+    """
+    display_frames = index.display_frames
+    i = bisect.bisect_left(display_frames, target_frame)
+    target_is_safe = i < len(display_frames) and display_frames[i] == target_frame
+    j = i + 1 if target_is_safe else i
+    before = (index.decode_frames[i-1], display_frames[i-1]) if i > 0 else None
+    after = (index.decode_frames[j], display_frames[j]) if j < len(display_frames) else None
+    return target_is_safe, before, after
+
+
+def _keyframes_through(index: KeyframeIndex, target_frame, after):
+    """
+    (decode_frame, display_frame) of every safe cut frame from 0 up to the first one after the target.
+    """
+    last = after[1] if after is not None else target_frame
+    return [(d, p) for d, p in zip(index.decode_frames, index.display_frames) if p <= last]
+
+
+def _unit_offset(buf, pos, lower=0):
+    """
+    Byte offset a unit starting with the start code at pos should be cut at.
+    Includes the leading zero_byte of a 4-byte start code so it stays with the unit it introduces.
+    """
+    return pos - 1 if pos > lower and buf[pos-1] == 0 else pos
+
+
+def _header_unit_start(buf, pos, header_code, allowed_suffixes):
+    """
+    Returns the offset of the header_code start code directly preceding the start code at pos,
+    with only start codes in allowed_suffixes between them (e.g. a sequence header and its
+    extensions in front of a GOP header). Returns pos if there is no such header.
+    """
+    found = buf.rfind(header_code, max(0, pos - 4096), pos)
+    if found == -1:
+        return pos
+    for sc in _iter_start_codes(buf, found + 4, pos):
+        if buf[sc+3] not in allowed_suffixes:
+            return pos
+    return found
+
+
+def _h264_au_offset(buf, lower, pos, start):
+    """
+    Byte offset of the access unit whose first slice starts at pos, found by walking the NALs
+    between lower (just past the previous frame's first slice) and pos the same way _scan_h264
+    inspects them.
+    """
+    au_start = None
+    for sc in _iter_start_codes(buf, lower, pos):
+        nal_type = buf[sc+3] & 0x1F
+        if nal_type == H264_NAL_SLICE or nal_type == H264_NAL_IDR_SLICE:
+            au_start = None
+        elif au_start is None and nal_type in H264_AU_START_NALS:
+            au_start = sc
+    return _unit_offset(buf, pos if au_start is None else au_start, start)
+
+
+def _scan_h264(buf, start, end, stop_after, status, inspect_window: int = H264_INSPECT_WINDOW,
+               frame_base: int = 0, checkpoints=None) -> Tuple[KeyframeIndex, ScanStats]:
+    """
+    Scans buf[start:end] of an H.264 Annex B byte stream for IDR frames.
+
+    The stream is searched directly for start codes and every NAL is classified from
+    its one-byte header (forbidden_zero_bit, nal_ref_idc, nal_unit_type):
+        nal_unit_type 1 = non-IDR slice
+        nal_unit_type 5 = IDR slice
+    A new access unit (frame) begins at the first slice of each picture, which is the
+    slice with first_mb_in_slice = 0. first_mb_in_slice is the first ue(v) field of the
+    slice header, so it is 0 exactly when the first bit after the NAL header is set.
+    Counting on the first slice rather than on access unit delimiters also works for
+    streams that were muxed without AUDs.
+    The byte offset stored for an IDR frame is the start of its access unit, i.e. the
+    AUD/SPS/PPS/SEI NALs in front of its first slice.
+
+    The scan runs in two phases. Up to inspect_window frames before stop_after (or through
+    the whole range without stop_after) frames are only counted: H264_FIRST_SLICE finds the
+    first slice of every frame in C, so the other slices, SEI and parameter set NALs are never
+    visited from Python. Only IDR frames have the NALs of their access unit walked to find its
+    offset. From there on every NAL is inspected.
+    frame_base: frame number of the first frame in the range, when resuming from a frame map point.
+    checkpoints: list that (frame, offset) resume points of every FRAME_MAP_STEP-th frame are added to.
+    """
+    idr_frames = []
+    offsets = []
+    current_frame = frame_base - 1
+
+    # counting phase
+    count_until = None if stop_after is None else stop_after - inspect_window
+    inspect_from = start    # just past the first slice of the last frame counted
+    counted = 0
+    if count_until is None or count_until > frame_base:
+        for match in H264_FIRST_SLICE.finditer(buf, start, end):
+            if count_until is not None and current_frame + 1 >= count_until:
+                break
+            pos = match.start()
+            current_frame += 1
+            counted += 1
+            if status is not None and current_frame % 1000 == 0:
+                status.update(f"Counting frame {current_frame}")
+
+            if buf[pos+3] & 0x1F == H264_NAL_IDR_SLICE:
+                idr_frames.append(current_frame)
+                offsets.append(_h264_au_offset(buf, inspect_from, pos, start))
+            elif checkpoints is not None and current_frame % FRAME_MAP_STEP == 0:
+                checkpoints.append((current_frame, pos))
+            inspect_from = pos + 3
+
+    # inspection phase
+    au_start = None     # first non-VCL NAL after the previous frame's slices
+    size = len(buf)
+    inspected = 0
+    for inspected, pos in enumerate(_iter_start_codes(buf, inspect_from, end), 1):
+        # NAL header byte and the first byte of the slice header
+        if pos + 4 >= size:
+            break
+        nal_type = buf[pos+3] & 0x1F
+        if nal_type != H264_NAL_SLICE and nal_type != H264_NAL_IDR_SLICE:
+            # AUD, SPS, PPS, SEI and prefix NALs open the next access unit (H.264 §7.4.1.2.3)
+            if au_start is None and nal_type in H264_AU_START_NALS:
+                au_start = pos
+            continue
+        # first_mb_in_slice != 0, another slice of the current frame
+        if not buf[pos+4] & 0x80:
+            au_start = None
+            continue
+
+        current_frame += 1
+        if status is not None and current_frame % 1000 == 0:
+            status.update(f"Scanning frame {current_frame}")
+
+        if nal_type == H264_NAL_IDR_SLICE:
+            idr_frames.append(current_frame)
+            offsets.append(_unit_offset(buf, pos if au_start is None else au_start, start))
+            # found an IDR frame after the target, stop
+            if stop_after is not None and current_frame > stop_after:
+                break
+        elif checkpoints is not None and current_frame % FRAME_MAP_STEP == 0:
+            checkpoints.append((current_frame, pos))
+        au_start = None
+    else:
+        pos = end
+
+    index = KeyframeIndex('h264', current_frame + 1, idr_frames, list(idr_frames), offsets)
+    return index, ScanStats(pos - start, counted + inspected, current_frame + 1 - frame_base)
+
+
+def _seek_scan_h264(video_file, buf, stop_after, status,
+                    inspect_window: int = H264_INSPECT_WINDOW) -> Tuple[KeyframeIndex, ScanStats]:
+    """
+    Early-stop H.264 scan that starts from the frame map of earlier scans instead of frame 0.
+
+    The frame map covers frames 0 to frame_count without gaps, since every scan starts at one
+    of its points, so the IDR frames in front of the resume point are taken from it as they are.
+    The scan resumes at the last point before the inspect window of stop_after, and is skipped
+    entirely when the map already holds an IDR frame after stop_after.
+    The map is extended with the IDR frames and resume points of this scan afterwards.
+    """
+    frame_map = _read_frame_map(video_file)
+    if frame_map is None:
+        frame_map = FrameMap(0, [], [], [])
+
+    idr_points = [(frame, offset) for frame, offset, is_idr
+                  in zip(frame_map.frames, frame_map.offsets, frame_map.idr) if is_idr]
+    idr_after = bisect.bisect_right(idr_points, (stop_after, sys.maxsize))
+    if idr_after < len(idr_points):
+        known = idr_points[:idr_after + 1]
+        frames = [frame for frame, _ in known]
+        return KeyframeIndex('h264', frame_map.frame_count, frames, list(frames),
+                             [offset for _, offset in known]), ScanStats()
+
+    frame_base, seek_offset = 0, 0
+    i = bisect.bisect_right(frame_map.frames, stop_after - inspect_window) - 1
+    if i >= 0:
+        frame_base, seek_offset = frame_map.frames[i], frame_map.offsets[i]
+        if status is not None:
+            status.update(f"Resuming at frame {frame_base}")
+
+    checkpoints = []
+    scan, stats = _run_scanner(_scan_h264, buf, seek_offset, len(buf), stop_after, status,
+                               inspect_window, frame_base, checkpoints)
+    known = [point for point in idr_points if point[0] < frame_base]
+    index = KeyframeIndex('h264', scan.frame_count,
+                          [frame for frame, _ in known] + scan.decode_frames,
+                          [frame for frame, _ in known] + scan.display_frames,
+                          [offset for _, offset in known] + scan.offsets)
+
+    points = {frame: (offset, is_idr) for frame, offset, is_idr
+              in zip(frame_map.frames, frame_map.offsets, frame_map.idr)}
+    points.update((frame, (offset, 0)) for frame, offset in checkpoints)
+    points.update((frame, (offset, 1)) for frame, offset in zip(scan.decode_frames, scan.offsets))
+    frames = sorted(points)
+    _write_frame_map(video_file, FrameMap(max(frame_map.frame_count, scan.frame_count), frames,
+                                          [points[frame][0] for frame in frames],
+                                          [points[frame][1] for frame in frames]))
+    return index, stats
+
+
+def _snap_h264(buf, pos):
+    """
+    Offset of the first H.264 access unit that starts at or after pos, or -1 if there is none.
+    """
+    size = len(buf)
+    seen_vcl = False
+    au_start = -1
+    for sc in _iter_start_codes(buf, pos):
+        if sc + 4 >= size:
+            break
+        nal_type = buf[sc+3] & 0x1F
+        if nal_type == H264_NAL_SLICE or nal_type == H264_NAL_IDR_SLICE:
+            if au_start != -1:
+                return _unit_offset(buf, au_start, pos)
+            if seen_vcl and buf[sc+4] & 0x80:
+                return _unit_offset(buf, sc, pos)
+            seen_vcl = True
+        elif seen_vcl and au_start == -1 and nal_type in H264_AU_START_NALS:
+            au_start = sc
+    return -1
+
+
+def _scan_hevc(buf, start, end, stop_after, status) -> Tuple[KeyframeIndex, ScanStats]:
+    """
+    Scans buf[start:end] of an HEVC Annex B byte stream for IRAP frames that are safe cut points.
+
+    Every NAL is classified from its two-byte header
+    (forbidden_zero_bit, nal_unit_type (6 bits), nuh_layer_id (6 bits), nuh_temporal_id_plus1):
+        nal_unit_type 0-9   = trailing and leading (RADL/RASL) pictures
+        nal_unit_type 16-23 = IRAP pictures (16-18 BLA, 19-20 IDR, 21 CRA, 22-23 reserved)
+    A new picture begins at the slice segment with first_slice_segment_in_pic_flag = 1,
+    the first bit after the NAL header. Only the base layer (nuh_layer_id = 0) is counted.
+
+    IDR pictures are always safe cut points. CRA and BLA pictures may be followed by RASL
+    pictures, which reference frames from before the IRAP and can't be decoded after a cut,
+    much like an open GOP in MPEG-2. A CRA/BLA picture only counts as a safe cut point if no
+    RASL picture follows it before the next trailing picture.
+
+    Frames are numbered in decode order, like H.264. Leading pictures follow their IRAP in
+    decode order but are displayed before it, so the display number of a safe frame is its
+    decode number plus the count of RADL pictures that follow it.
+    """
+    irap_frames = []
+    display_frames = []
+    offsets = []
+    current_frame = -1
+    open_irap = False   # the last frame in irap_frames is a CRA/BLA whose leading pictures are still unchecked
+    leading = False     # leading pictures that follow belong to the last frame in irap_frames
+    au_start = None     # first non-VCL NAL after the previous frame's slice segments
+
+    size = len(buf)
+    inspected = 0
+    for inspected, pos in enumerate(_iter_start_codes(buf, start, end), 1):
+        # two-byte NAL header and the first byte of the slice segment header
+        if pos + 5 >= size:
+            break
+        b0 = buf[pos+3]
+        nal_type = (b0 >> 1) & 0x3F
+        if nal_type > HEVC_NAL_IRAP_END or (HEVC_NAL_RASL_R < nal_type < HEVC_NAL_BLA_W_LP):
+            # VPS, SPS, PPS, AUD and prefix SEI NALs open the next access unit (H.265 §7.4.2.4.4)
+            if au_start is None and nal_type in HEVC_AU_START_NALS:
+                au_start = pos
+            continue
+        # nuh_layer_id != 0, enhancement layer
+        if (b0 & 0x01) or (buf[pos+4] & 0xF8):
+            continue
+        # first_slice_segment_in_pic_flag == 0, another slice segment of the current frame
+        if not buf[pos+5] & 0x80:
+            au_start = None
+            continue
+
+        current_frame += 1
+        if status is not None and current_frame % 1000 == 0:
+            status.update(f"Scanning frame {current_frame}")
+        frame_start = pos if au_start is None else au_start
+        au_start = None
+
+        if nal_type >= HEVC_NAL_BLA_W_LP:
+            irap_frames.append(current_frame)
+            display_frames.append(current_frame)
+            offsets.append(_unit_offset(buf, frame_start, start))
+            open_irap = not (HEVC_NAL_IDR_W_RADL <= nal_type <= HEVC_NAL_IDR_N_LP)
+            leading = True
+        elif nal_type >= HEVC_NAL_RASL_N:
+            # RASL picture, the preceding CRA/BLA is not a clean cut point
+            if open_irap:
+                irap_frames.pop()
+                display_frames.pop()
+                offsets.pop()
+                open_irap = False
+                leading = False
+            continue
+        elif nal_type >= HEVC_NAL_RADL_N:
+            # RADL pictures are decodable and displayed before their IRAP, keep waiting for a trailing picture
+            if leading:
+                display_frames[-1] += 1
+            continue
+        else:
+            # trailing picture, no leading pictures can follow anymore
+            open_irap = False
+            leading = False
+
+        # found a safe frame after the target whose display number is final, stop
+        if (stop_after is not None and not leading and display_frames
+                and display_frames[-1] > stop_after):
+            break
+    else:
+        pos = end
+
+    index = KeyframeIndex('hevc', current_frame + 1, irap_frames, display_frames, offsets)
+    return index, ScanStats(pos - start, inspected, current_frame + 1)
+
+
+def _snap_hevc(buf, pos):
+    """
+    Offset of the first HEVC access unit at or after pos whose picture is an IRAP or trailing picture,
+    or -1 if there is none. Never splitting in front of a leading picture keeps the RASL check of
+    a CRA/BLA within a single range.
+    """
+    size = len(buf)
+    seen_vcl = False
+    au_start = -1
+    for sc in _iter_start_codes(buf, pos):
+        if sc + 5 >= size:
+            break
+        b0 = buf[sc+3]
+        nal_type = (b0 >> 1) & 0x3F
+        if nal_type > HEVC_NAL_IRAP_END or (HEVC_NAL_RASL_R < nal_type < HEVC_NAL_BLA_W_LP):
+            if seen_vcl and au_start == -1 and nal_type in HEVC_AU_START_NALS:
+                au_start = sc
+            continue
+        if (b0 & 0x01) or (buf[sc+4] & 0xF8):
+            continue
+        if au_start != -1 or (seen_vcl and buf[sc+5] & 0x80):
+            frame_start = sc if au_start == -1 else au_start
+            if nal_type < HEVC_NAL_RADL_N or nal_type >= HEVC_NAL_BLA_W_LP:
+                return _unit_offset(buf, frame_start, pos)
+            au_start = -1
+        seen_vcl = True
+    return -1
+
+
+def _scan_mpeg2(buf, start, end, stop_after, status) -> Tuple[KeyframeIndex, ScanStats]:
+    """
+    Scans buf[start:end] of an MPEG-2 video elementary stream for closed GOP I-frames.
+
+    The GOP and picture headers are read straight from the bitstream. Both fields
+    needed sit at fixed bit offsets right after their start codes (ISO/IEC 13818-2 §6.2.2.6, §6.2.3):
+        0x000001B8 group_of_pictures_header:
+            time_code (25 bits), closed_gop (1 bit), broken_link (1 bit)
+        0x00000100 picture_header:
+            temporal_reference (10 bits), picture_coding_type (3 bits, 1 = I-frame)
+    Only these two start codes are searched for, so the slice start codes that make
+    up the bulk of an MPEG-2 stream are skipped over in C.
+    The byte offset stored for a closed GOP I-frame is its GOP header, or the sequence
+    header in front of it if there is one.
+    """
+    decode_frames = []          # closed GOP I-frames, decode order
+    display_frames = []         # closed GOP I-frames, display order
+    offsets = []
     pending_closed_gop = False  # closed_gop flag from the most recent GOP header
-    current_temporal_ref = 0    # temporal_reference value of the current picture
+    gop_offset = start          # byte offset of the most recent GOP header
     max_temporal_ref = -1       # highest temporal_reference seen in the current GOP
     gop_display_base = 0        # display-order frame number of the first frame in this GOP
-    safe_before = None
-    safe_after = None
-    target_is_safe = False
- 
+    picture_count = 0
+    gop_count = 0
+
     # NOTE: MPEG-2 frames are stored in decode order but displayed in a different order.
     # B-frames are decoded after the I/P frames they reference, but displayed before them.
     # each picture header carries a temporal_reference field which is the frame's
     # display-order offset within its GOP. The display frame number is:
     #   display_frame = gop_display_base + temporal_reference
- 
-    try:
-        with status_ctx as status:
-            for line in process.stdout:
-                match = re.match(r'\[.*?\]\s+(.*)', line)
-                if not match:
-                    continue
- 
-                content = match.group(1).strip().lower()
- 
-                # GOP header will tell us if the upcoming I-frame is a closed or open GOP I-frame.
-                # advance the display base by the number of frames in the previous GOP
-                # (max temporal_reference + 1), then reset for the new GOP.
-                if content == "group of pictures header":
-                    in_gop_header = True
-                    in_picture_header = False
-                    gop_display_base += max_temporal_ref + 1
-                    max_temporal_ref = -1
-                    pending_closed_gop = False  # reset, updated below if field is present
-                    continue
- 
-                if in_gop_header and "closed_gop" in content:
-                    parts = content.split('=')
-                    if len(parts) >= 2:
-                        pending_closed_gop = parts[-1].strip() == '1'
-                    in_gop_header = False
-                    continue
- 
-                # new frame, reset temporal ref, check early exit
-                if content == "picture header":
-                    in_picture_header = True
-                    in_gop_header = False
-                    current_temporal_ref = 0
- 
-                    if verbose and status is not None:
-                        status.update(f"Scanning around display frame {gop_display_base}")
- 
-                    if safe_after is not None:
-                        process.terminate()
-                        break
- 
-                    continue
- 
-                # capture the display-order offset of this frame within its GOP
-                if in_picture_header and "temporal_reference" in content:
-                    parts = content.split('=')
-                    if len(parts) >= 2:
-                        try:
-                            current_temporal_ref = int(parts[-1].strip())
-                            if current_temporal_ref > max_temporal_ref:
-                                max_temporal_ref = current_temporal_ref
-                        except ValueError:
-                            pass
-                    continue
- 
-                # frame type, use display_frame for all comparisons
-                if in_picture_header and "picture_coding_type" in content:
-                    in_picture_header = False
-                    parts = content.split('=')
-                    if len(parts) >= 2:
-                        coding_type = parts[-1].strip()
-                        if coding_type == '1':  # I-frame
-                            decode_frame = gop_display_base
-                            display_frame = gop_display_base + current_temporal_ref
-                            all_i_frames.add((decode_frame, display_frame))
-                            if pending_closed_gop:
-                                if display_frame == target_frame:
-                                    target_is_safe = True
-                                    safe_cut_frames.add((decode_frame, display_frame))
-                                    process.terminate()
-                                    break
-                                elif display_frame < target_frame:
-                                    safe_before = (decode_frame, display_frame)
-                                    safe_cut_frames.add((decode_frame, display_frame))
-                                elif display_frame > target_frame and safe_after is None:
-                                    safe_after = (decode_frame, display_frame)
-                                    safe_cut_frames.add((decode_frame, display_frame))
-    finally:
-        process.wait()
- 
-    end_time = time.time()
-    console.print(f"\nExecution time: [blue]{end_time - start_time:.3f}[/] seconds")
-    console.print(f"\nMPEG-2 output frame format: (decoding_order, display_order)")
-    # report target frame status
-    if target_is_safe:
-        console.print(f"[green]Frame {target_frame} is a closed GOP I-frame[/]")
-    else:
-        console.print(f"[yellow]Frame {target_frame} is not a closed GOP I-frame[/]")
- 
-    # nearest safe cut points
-    if safe_before is not None:
-        console.print(f"Nearest closed GOP I-frame before target: [green]{safe_before}[/]")
-    else:
-        console.print("[yellow]No closed GOP I-frame found before the target frame[/]")
- 
-    if safe_after is not None:
-        console.print(f"Nearest closed GOP I-frame after target: [green]{safe_after}[/]")
+
+    size = len(buf)
+    find = buf.find
+    next_gop = find(MPEG2_GOP_START_CODE, start, end)
+    next_picture = find(MPEG2_PICTURE_START_CODE, start, end)
+
+    while next_picture != -1:
+        # GOP header will tell us if the upcoming I-frame is a closed or open GOP I-frame.
+        # advance the display base by the number of frames in the previous GOP
+        # (max temporal_reference + 1), then reset for the new GOP.
+        if next_gop != -1 and next_gop < next_picture:
+            gop_display_base += max_temporal_ref + 1
+            max_temporal_ref = -1
+            # closed_gop is bit 6 of the 4th byte after the start code
+            pending_closed_gop = next_gop + 7 < size and bool(buf[next_gop+7] & 0x40)
+            gop_offset = next_gop
+            gop_count += 1
+            next_gop = find(MPEG2_GOP_START_CODE, next_gop + 4, end)
+            continue
+
+        pos = next_picture
+        if pos + 5 >= size:
+            break
+        next_picture = find(MPEG2_PICTURE_START_CODE, pos + 4, end)
+
+        picture_count += 1
+        if status is not None and picture_count % 1000 == 0:
+            status.update(f"Scanning around display frame {gop_display_base}")
+
+        # capture the display-order offset of this frame within its GOP
+        b0 = buf[pos+4]
+        b1 = buf[pos+5]
+        current_temporal_ref = (b0 << 2) | (b1 >> 6)
+        if current_temporal_ref > max_temporal_ref:
+            max_temporal_ref = current_temporal_ref
+
+        # frame type, use display_frame for all comparisons
+        coding_type = (b1 >> 3) & 0x07
+        if coding_type == 1 and pending_closed_gop:  # closed GOP I-frame
+            display_frame = gop_display_base + current_temporal_ref
+            decode_frames.append(gop_display_base)
+            display_frames.append(display_frame)
+            unit_start = _header_unit_start(buf, gop_offset, MPEG2_SEQUENCE_START_CODE, MPEG2_SEQUENCE_SUFFIXES)
+            offsets.append(_unit_offset(buf, unit_start, start))
+            # found a safe frame after the target, stop
+            if stop_after is not None and display_frame > stop_after:
+                break
     else:
-        console.print("[yellow]No closed GOP I-frame found after the target frame[/]")
- 
-    if verbose:
-        console.print(f"All closed GOP I-frames: [green]{sorted(safe_cut_frames)}[/]")
+        pos = end
+
+    frame_count = gop_display_base + max_temporal_ref + 1
+    index = KeyframeIndex('mpeg2', frame_count, decode_frames, display_frames, offsets)
+    return index, ScanStats(pos - start, gop_count + picture_count, frame_count)
+
 
+def _snap_mpeg2(buf, pos):
+    """
+    Offset of the first GOP (including its sequence header) at or after pos, or -1 if there is none.
+    """
+    gop = buf.find(MPEG2_GOP_START_CODE, pos)
+    if gop == -1:
+        return -1
+    unit_start = _header_unit_start(buf, gop, MPEG2_SEQUENCE_START_CODE, MPEG2_SEQUENCE_SUFFIXES)
+    return _unit_offset(buf, unit_start)
 
-def find_safe_frames_vc1(video_file, target_frame, verbose: bool):
+
+def _scan_vc1(buf, start, end, stop_after, status) -> Tuple[KeyframeIndex, ScanStats]:
     """
-    Finds closed entry-point I-frames in a VC-1 Advanced Profile elementary stream by
-    parsing the raw bitstream.
- 
+    Finds closed entry-point I-frames in buf[start:end] of a VC-1 Advanced Profile elementary
+    stream by parsing the raw bitstream.
+
     ffmpeg trace_headers does not support VC-1, so instead we scan the file for
     4-byte start codes (0x00 0x00 0x01 + suffix) manually:
         0x0D = Frame
         0x0E = Entry Point Header
         0x0F = Sequence Header
     (SMPTE 421M Annex E; confirmed by GStreamer VC-1 parser)
- 
+
     In VC-1 AP, an Entry Point Header always immediately precedes the I-frame
     it introduces. A safe cut point is any frame immediately following an
     Entry Point Header where CLOSED_ENTRY = 1, meaning the segment is
     self-contained and does not reference any frames from the previous segment.
- 
+
     Entry point header bit layout (SMPTE 421M §6.2, bits packed MSB-first):
         bit 7 of byte[0] after start code: BROKEN_LINK
         bit 6 of byte[0] after start code: CLOSED_ENTRY
- 
+
     NOTE: Frame numbers reported here are in decode order, which may differ
     from display order if the stream contains B-frames. Unlike MPEG-2, VC-1
     does not carry a temporal_reference field that is easily extractable
@@ -295,185 +999,1509 @@ def find_safe_frames_vc1(video_file, target_frame, verbose: bool):
     The parsing below was derived from the SMPTE Standard VC-1 proposal document
     found here https://multimedia.cx/mirror/s421m.pdf
     """
-    start_time = time.time()
- 
-    # VC-1 AP start code suffixes
-    SC_FRAME       = 0x0D
-    SC_ENTRYPOINT  = 0x0E
- 
-    safe_cut_frames = set()   # closed entry-point I-frames
-    all_i_frames = set()      # every I-frame (i.e. every frame following any entry point)
+    cep_frames = []                # closed entry-point I-frames
+    offsets = []
     current_frame = -1
     pending_closed_entry = False   # CLOSED_ENTRY from the most recent entry point header
-    pending_any_entry = False      # any entry point seen (closed or open), for all_i_frames
-    safe_before = None
-    safe_after = None
-    target_is_safe = False
-    done = False
- 
-    status_ctx = console.status("Starting scan...", spinner="dots") if verbose else contextlib.nullcontext()
- 
-    # read in chunks with a 4-byte tail carried over between chunks so that
-    # start codes surrounding a chunk boundary are never missed
-    CHUNK_SIZE = 65536
- 
-    try:
-        with open(video_file, 'rb') as f, status_ctx as status:
-            tail = b''
-            while not done:
-                chunk = f.read(CHUNK_SIZE)
-                if not chunk:
+    entry_offset = start           # byte offset of the most recent entry point header
+
+    # the whole stream is memory-mapped, so start codes can never straddle a
+    # read boundary and no tail has to be carried between chunks
+    size = len(buf)
+    inspected = 0
+    for inspected, pos in enumerate(_iter_start_codes(buf, start, end), 1):
+        if pos + 3 >= size:
+            break
+
+        scs = buf[pos+3]
+
+        if scs == VC1_SC_ENTRYPOINT:
+            # The byte immediately after the start code holds
+            # BROKEN_LINK (bit 7) and CLOSED_ENTRY (bit 6).
+            # This byte can never be an emulation prevention byte
+            # (0x03) because it follows directly after 0x01.
+            if pos + 4 < size:
+                header_byte = buf[pos+4]
+                pending_closed_entry = bool(header_byte & 0x40)  # bit 6
+                entry_offset = pos
+
+        elif scs == VC1_SC_FRAME:
+            current_frame += 1
+
+            if status is not None and current_frame % 1000 == 0:
+                status.update(f"Scanning frame {current_frame}")
+
+            if pending_closed_entry:
+                cep_frames.append(current_frame)
+                unit_start = _header_unit_start(buf, entry_offset, VC1_SEQUENCE_START_CODE, VC1_SEQUENCE_SUFFIXES)
+                offsets.append(_unit_offset(buf, unit_start, start))
+                # found a safe frame after the target, stop
+                if stop_after is not None and current_frame > stop_after:
                     break
- 
-                data = tail + chunk
-                i = 0
- 
-                while i <= len(data) - 4:
-                    # skip bytes that can't start a start code
-                    if data[i] != 0x00:
-                        i += 1
-                        continue
-                    if data[i+1] != 0x00:
-                        i += 2
+
+            # consume the entry point flag regardless of type
+            pending_closed_entry = False
+    else:
+        pos = end
+
+    index = KeyframeIndex('vc1', current_frame + 1, cep_frames, list(cep_frames), offsets)
+    return index, ScanStats(pos - start, inspected, current_frame + 1)
+
+
+def _snap_vc1(buf, pos):
+    """
+    Offset of the first entry point (including its sequence header) at or after pos, or -1 if there is none.
+    """
+    entry = buf.find(VC1_ENTRYPOINT_START_CODE, pos)
+    if entry == -1:
+        return -1
+    unit_start = _header_unit_start(buf, entry, VC1_SEQUENCE_START_CODE, VC1_SEQUENCE_SUFFIXES)
+    return _unit_offset(buf, unit_start)
+
+
+# codec name -> (range scanner, range boundary snapper)
+SCANNERS = {
+    'h264': (_scan_h264, _snap_h264),
+    'hevc': (_scan_hevc, _snap_hevc),
+    'mpeg2': (_scan_mpeg2, _snap_mpeg2),
+    'vc1': (_scan_vc1, _snap_vc1),
+}
+
+
+def _split_ranges(buf, codec, parts):
+    """
+    Splits the stream into up to `parts` byte ranges whose boundaries are snapped to the
+    start of a frame the codec's scanner can start from without any state from the previous range.
+    """
+    size = len(buf)
+    snap = SCANNERS[codec][1]
+    bounds = [0]
+    for k in range(1, parts):
+        bound = snap(buf, size * k // parts)
+        if bound == -1:
+            break
+        if bound > bounds[-1]:
+            bounds.append(bound)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _run_scanner(scan, *args) -> Tuple[KeyframeIndex, ScanStats]:
+    """
+    Runs a scanner and adds the wall time and CPU time it took to its ScanStats.
+    """
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    index, stats = scan(*args)
+    wall_time = time.perf_counter() - wall_start
+    return index, stats._replace(scan_time=wall_time, busy_time=wall_time, parse_time=time.process_time() - cpu_start)
+
+
+def _scan_range(video_file, codec, start, end) -> Tuple[KeyframeIndex, ScanStats]:
+    """
+    Worker process entry point, scans buf[start:end] with frames numbered from the start of the range.
+    """
+    with _map_stream(video_file) as mm:
+        return _run_scanner(SCANNERS[codec][0], mm, start, end, None, None)
+
+
+def _merge_ranges(codec, ranges) -> Tuple[KeyframeIndex, ScanStats]:
+    """
+    Joins per-range (KeyframeIndex, ScanStats) results into one KeyframeIndex by offsetting
+    each range's frame numbers with the number of frames in all ranges before it.
+    """
+    frame_base = 0
+    stats = ScanStats()
+    decode_frames = []
+    display_frames = []
+    offsets = []
+    for scan, range_stats in ranges:
+        decode_frames.extend(frame_base + frame for frame in scan.decode_frames)
+        display_frames.extend(frame_base + frame for frame in scan.display_frames)
+        offsets.extend(scan.offsets)
+        frame_base += scan.frame_count
+        stats = stats.add(range_stats)
+    return KeyframeIndex(codec, frame_base, decode_frames, display_frames, offsets), stats
+
+
+def _scan_stream(video_file, codec, stop_after, status, jobs: int = 1, container: bool = False,
+                 inspect_window: int = H264_INSPECT_WINDOW) -> Tuple[KeyframeIndex, ScanStats]:
+    """
+    Scans a whole stream for its safe cut frames, returns its KeyframeIndex and ScanStats.
+    With jobs > 1 (and no stop_after) the file is split into byte ranges that are scanned by
+    a pool of worker processes and merged into global frame numbers afterwards.
+    container: video_file is a container that is demuxed instead of an elementary stream.
+    inspect_window: frames in front of stop_after an H.264 scan inspects in full, see _scan_h264.
+    """
+    if container:
+        return _run_scanner(_scan_container, video_file, codec, stop_after, status)
+    with _map_stream(video_file) as mm:
+        if codec == 'h264' and stop_after is not None:
+            return _seek_scan_h264(video_file, mm, stop_after, status, inspect_window)
+        if jobs <= 1 or stop_after is not None:
+            return _run_scanner(SCANNERS[codec][0], mm, 0, len(mm), stop_after, status)
+        # a few ranges per worker keeps all workers busy when ranges differ in bitrate
+        ranges = _split_ranges(mm, codec, max(1, min(jobs * 4, len(mm) // PARALLEL_MIN_RANGE)))
+
+    if status is not None:
+        status.update(f"Scanning {len(ranges)} ranges with {jobs} jobs")
+    wall_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_scan_range, str(video_file), codec, start, end) for start, end in ranges]
+        index, stats = _merge_ranges(codec, [future.result() for future in futures])
+    return index, stats._replace(scan_time=time.perf_counter() - wall_start)
+
+
+def _nal_length_size(codec, extradata):
+    """
+    Size of the NAL length prefix used by packets of an MP4/MKV style stream, taken from its
+    avcC/hvcC extradata. Returns 0 for streams carrying Annex B start codes (M2TS, raw).
+    """
+    if not extradata or extradata[0] != 1:
+        return 0
+    if codec == 'h264' and len(extradata) > 4:
+        return (extradata[4] & 0x03) + 1
+    if codec == 'hevc' and len(extradata) > 21:
+        return (extradata[21] & 0x03) + 1
+    return 0
+
+
+def _iter_packet_nals(data, length_size):
+    """
+    Yields the offset of the NAL header of every NAL unit in a demuxed packet.
+    """
+    if length_size == 0 or data[:3] == START_CODE or data[:4] == b'\x00' + START_CODE:
+        for pos in _iter_start_codes(data):
+            yield pos + 3
+        return
+    pos = 0
+    while pos + length_size < len(data):
+        nal_size = int.from_bytes(data[pos:pos+length_size], 'big')
+        yield pos + length_size
+        pos += length_size + nal_size
+
+
+def _packet_picture_type(codec, data, length_size):
+    """
+    Classifies a demuxed packet from the headers it carries. Returns
+        h264:  the nal_unit_type of the first slice
+        hevc:  the nal_unit_type of the first base layer slice segment
+        mpeg2: 1 for a closed GOP I-frame, 0 otherwise
+        vc1:   1 for a closed entry point, 0 for an open one, None without an entry point header
+    """
+    size = len(data)
+    if codec == 'h264':
+        for pos in _iter_packet_nals(data, length_size):
+            if pos < size and 1 <= data[pos] & 0x1F <= H264_NAL_IDR_SLICE:
+                return data[pos] & 0x1F
+    elif codec == 'hevc':
+        for pos in _iter_packet_nals(data, length_size):
+            if pos + 1 < size and (data[pos] >> 1) & 0x3F <= HEVC_NAL_IRAP_END:
+                if not (data[pos] & 0x01) and not (data[pos+1] & 0xF8):
+                    return (data[pos] >> 1) & 0x3F
+    elif codec == 'mpeg2':
+        gop = data.find(MPEG2_GOP_START_CODE)
+        picture = data.find(MPEG2_PICTURE_START_CODE)
+        if gop != -1 and gop + 7 < size and picture != -1 and picture + 5 < size:
+            closed_gop = bool(data[gop+7] & 0x40)
+            return int(closed_gop and (data[picture+5] >> 3) & 0x07 == 1)
+        return 0
+    elif codec == 'vc1':
+        entry = data.find(VC1_ENTRYPOINT_START_CODE)
+        if entry != -1 and entry + 4 < size:
+            return int(bool(data[entry+4] & 0x40))
+    return None
+
+
+def _scan_container(video_file, codec, stop_after, status) -> Tuple[KeyframeIndex, ScanStats]:
+    """
+    Indexes the safe cut frames of the first video stream of a container (MKV, M2TS, MP4...)
+    by demuxing its packets without decoding them, which avoids extracting the stream first.
+
+    Only packets the demuxer flags as keyframes are inspected, plus the packets after an HEVC
+    CRA/BLA frame until its RASL check is done. The NAL headers (H.264/HEVC) or GOP/entry point
+    headers (MPEG-2/VC-1) in a keyframe tell IDR frames apart from other I-frames the container
+    marks as keyframes. VC-1 keyframes without an entry point header in the packet (VC-1 in MKV
+    keeps it in the codec private data) are trusted as they are.
+
+    Frames are numbered directly from the container: decode order is the packet order and
+    display order is the rank of the packet's pts. Byte offsets are stored as -1, since a
+    container can't be cut like an elementary stream.
+    """
+    # demux from our own file object so the bytes read can be reported
+    with open(video_file, 'rb') as f, av.open(f) as container:
+        stream = container.streams.video[0]
+        length_size = _nal_length_size(codec, stream.codec_context.extradata)
+
+        decode_frames = []
+        pts_list = []            # pts of every packet, decode order
+        keyframe_pts = []        # pts of every safe cut frame
+        current_frame = -1
+        open_irap = False        # the last safe cut frame is a CRA/BLA whose leading pictures are still unchecked
+        stopping = False
+        inspected = 0
+
+        for packet in container.demux(stream):
+            if packet.size == 0:
+                continue
+            if stopping and packet.is_keyframe:
+                break
+            current_frame += 1
+            pts = packet.pts if packet.pts is not None else packet.dts
+            pts_list.append(current_frame if pts is None else pts)
+
+            if status is not None and current_frame % 1000 == 0:
+                status.update(f"Demuxing frame {current_frame}")
+
+            if not packet.is_keyframe and not open_irap:
+                continue
+            inspected += 1
+            picture_type = _packet_picture_type(codec, bytes(packet), length_size)
+
+            if codec == 'h264':
+                is_safe = picture_type == H264_NAL_IDR_SLICE
+            elif codec == 'hevc':
+                if picture_type is None:
+                    continue
+                if open_irap:
+                    # RASL picture, the preceding CRA/BLA is not a clean cut point
+                    if HEVC_NAL_RASL_N <= picture_type <= HEVC_NAL_RASL_R:
+                        decode_frames.pop()
+                        keyframe_pts.pop()
+                        open_irap = False
                         continue
-                    if data[i+2] != 0x01:
-                        i += 1
+                    if HEVC_NAL_RADL_N <= picture_type < HEVC_NAL_RASL_N:
                         continue
- 
-                    scs = data[i+3]
- 
-                    if scs == SC_ENTRYPOINT:
-                        # The byte immediately after the start code holds
-                        # BROKEN_LINK (bit 7) and CLOSED_ENTRY (bit 6).
-                        # This byte can never be an emulation prevention byte
-                        # (0x03) because it follows directly after 0x01.
-                        if i + 4 < len(data):
-                            header_byte = data[i+4]
-                            pending_closed_entry = bool(header_byte & 0x40)  # bit 6
-                            pending_any_entry = True
-                        i += 4
- 
-                    elif scs == SC_FRAME:
-                        current_frame += 1
- 
-                        if verbose and status is not None:
-                            status.update(f"Scanning frame {current_frame}")
- 
-                        # every frame that follows any entry point is an I-frame
-                        if pending_any_entry:
-                            all_i_frames.add(current_frame)
- 
-                        if pending_closed_entry:
-                            if current_frame == target_frame:
-                                target_is_safe = True
-                                safe_cut_frames.add(current_frame)
-                                done = True
-                                break
-                            elif current_frame < target_frame:
-                                safe_before = current_frame
-                                safe_cut_frames.add(current_frame)
-                            elif current_frame > target_frame and safe_after is None:
-                                safe_after = current_frame
-                                safe_cut_frames.add(current_frame)
- 
-                        # consume the entry point flags regardless of type
-                        pending_closed_entry = False
-                        pending_any_entry = False
- 
-                        if safe_after is not None:
-                            done = True
-                            break
- 
-                        i += 4
- 
-                    else:
-                        i += 4
- 
-                # carry the last 3 bytes into the next iteration so start codes
-                # at chunk boundaries are not missed
-                tail = data[-3:]
- 
+                    open_irap = False
+                is_safe = packet.is_keyframe and picture_type >= HEVC_NAL_BLA_W_LP
+                open_irap = is_safe and not (HEVC_NAL_IDR_W_RADL <= picture_type <= HEVC_NAL_IDR_N_LP)
+            elif codec == 'vc1':
+                is_safe = picture_type != 0
+            else:
+                is_safe = picture_type == 1
+
+            if is_safe:
+                decode_frames.append(current_frame)
+                keyframe_pts.append(pts_list[-1])
+            # found a safe frame after the target, read on to the next keyframe
+            # so every frame displayed before it is known, then stop
+            if (stop_after is not None and not open_irap and decode_frames
+                    and decode_frames[-1] > stop_after):
+                stopping = True
+        bytes_scanned = f.tell()
+
+    pts_list.sort()
+    display_frames = [bisect.bisect_left(pts_list, pts) for pts in keyframe_pts]
+    index = KeyframeIndex(codec, current_frame + 1, decode_frames, display_frames, [-1] * len(decode_frames))
+    return index, ScanStats(bytes_scanned, inspected, current_frame + 1)
+
+
+def _print_frame_table(result, label, show_decode: bool = False, playlist=None):
+    """
+    Prints one row per target frame with its status and the nearest safe cut frames around it.
+    show_decode: print frames as (decode_order, display_order) tuples instead of a single frame number.
+    playlist: PlaylistResult the targets are timeline frames of, adds the segment holding each target.
+    """
+    def fmt(keyframe):
+        if keyframe is None:
+            return "[yellow]-[/]"
+        return f"[green]{keyframe if show_decode else keyframe[1]}[/]"
+
+    table = Table()
+    table.add_column("Target", justify="right")
+    if playlist is not None:
+        table.add_column("Segment", justify="right")
+        table.add_column("Segment frame", justify="right")
+    table.add_column(label)
+    table.add_column("Before", justify="right")
+    table.add_column("After", justify="right")
+    for check in result.checks:
+        location = []
+        if playlist is not None:
+            segment, segment_frame = playlist.locate(check.target)
+            location = [str(segment + 1), str(segment_frame)]
+        table.add_row(str(check.target), *location, "[green]yes[/]" if check.is_safe else "[yellow]no[/]",
+                      fmt(check.before), fmt(check.after))
+    console.print(table)
+
+
+def _as_frame_list(target_frames):
+    """
+    Accepts a single frame number or an iterable of them, returns a sorted list without duplicates.
+    """
+    if isinstance(target_frames, int):
+        return [target_frames]
+    return sorted(set(target_frames))
+
+
+def _check_frames(video_file, codec, target_frames, verbose: bool, use_index: bool, jobs: int,
+                  container: bool, inspect_window: int = H264_INSPECT_WINDOW) -> ScanResult:
+    """
+    Loads or builds the keyframe index of video_file and resolves every target frame against it.
+    """
+    start_time = time.time()
+    target_frames = _as_frame_list(target_frames)
+    index, stats, from_index = _load_keyframes(video_file, codec, target_frames[-1], verbose,
+                                               use_index, jobs, container, inspect_window)
+    checks = [FrameCheck(target_frame, *_nearest_keyframes(index, target_frame)) for target_frame in target_frames]
+    return ScanResult(str(video_file), codec, checks, index, stats.bytes_scanned, time.time() - start_time,
+                      from_index, stats)
+
+
+def find_idr_frames(video_file, target_frames, verbose: bool, use_index: bool = True, jobs: int = 1,
+                    container: bool = False, quiet: bool = False,
+                    inspect_window: int = H264_INSPECT_WINDOW) -> ScanResult:
+    """
+    Determines whether the target frame is and IDR frame. If not, find the nearest bi-directional IDR frames.
+    video_file: Path to the H.264 video file.
+    target_frames: Frame number to check, or a list of frame numbers answered in a single scan.
+    use_index: Answer from (and save) the keyframe index of the file instead of rescanning it.
+    jobs: Number of processes that scan the file in parallel when the index is built.
+    container: video_file is a container (MKV, M2TS...) whose packets are demuxed instead of a raw stream.
+    quiet: Only return the result without printing it.
+    inspect_window: Without use_index, frames are only counted until this many frames before the last target.
+    """
+    result = _check_frames(video_file, 'h264', target_frames, verbose and not quiet, use_index, jobs, container,
+                           inspect_window)
+    if quiet:
+        return result
+
+    console.print(f"\nExecution time: [blue]{result.elapsed:.3f}[/] seconds")
+
+    if len(result.checks) > 1:
+        _print_frame_table(result, "IDR")
+    else:
+        target_frame, target_is_idr, idr_before, idr_after = result.checks[0]
+        if target_is_idr:
+            console.print(f"[green]Frame {target_frame} is an IDR frame[/]")
+        else:
+            console.print(f"[yellow]Frame {target_frame} is NOT an IDR frame[/]")
+
+        if idr_before is not None:
+            console.print(f"Nearest IDR frame before target: [green]{idr_before[1]}[/]")
+        else:
+            console.print("No IDR frame found before the target frame")
+
+        if idr_after is not None:
+            console.print(f"Nearest IDR frame after target: [green]{idr_after[1]}[/]")
+        else:
+            console.print("No IDR frame found after the target frame")
+
+    if verbose:
+        last = result.checks[-1]
+        idr_frames = [frame for _, frame in _keyframes_through(result.index, last.target, last.after)]
+        console.print(f"All IDR frames found: [green]{idr_frames}[/]")
+    return result
+
+
+def find_irap_frames(video_file, target_frames, verbose: bool, use_index: bool = True, jobs: int = 1,
+                     container: bool = False, quiet: bool = False) -> ScanResult:
+    """
+    Determines whether the target frame is an IRAP frame (IDR, or CRA/BLA without RASL pictures).
+    If not, find the nearest bi-directional IRAP frames. See _scan_hevc for the bitstream details.
+    video_file: Path to the HEVC video file.
+    target_frames: Frame number to check, or a list of frame numbers answered in a single scan.
+    use_index: Answer from (and save) the keyframe index of the file instead of rescanning it.
+    jobs: Number of processes that scan the file in parallel when the index is built.
+    container: video_file is a container (MKV, M2TS...) whose packets are demuxed instead of a raw stream.
+    quiet: Only return the result without printing it.
+    """
+    result = _check_frames(video_file, 'hevc', target_frames, verbose and not quiet, use_index, jobs, container)
+    if quiet:
+        return result
+
+    console.print(f"\nExecution time: [blue]{result.elapsed:.3f}[/] seconds")
+
+    if len(result.checks) > 1:
+        _print_frame_table(result, "IRAP")
+    else:
+        target_frame, target_is_irap, irap_before, irap_after = result.checks[0]
+        if target_is_irap:
+            console.print(f"[green]Frame {target_frame} is an IRAP frame[/]")
+        else:
+            console.print(f"[yellow]Frame {target_frame} is NOT an IRAP frame[/]")
+
+        if irap_before is not None:
+            console.print(f"Nearest IRAP frame before target: [green]{irap_before[1]}[/]")
+        else:
+            console.print("No IRAP frame found before the target frame")
+
+        if irap_after is not None:
+            console.print(f"Nearest IRAP frame after target: [green]{irap_after[1]}[/]")
+        else:
+            console.print("No IRAP frame found after the target frame")
+
+    if verbose:
+        last = result.checks[-1]
+        irap_frames = [frame for _, frame in _keyframes_through(result.index, last.target, last.after)]
+        console.print(f"All IRAP frames found: [green]{irap_frames}[/]")
+    return result
+
+
+def find_safe_frames_mpeg2(video_file, target_frames, verbose: bool, use_index: bool = True, jobs: int = 1,
+                           container: bool = False, quiet: bool = False) -> ScanResult:
+    """
+    Determines whether the target frame is a closed GOP I-frame.
+    If not, find the nearest bi-directional closed GOP I-frames.
+    video_file: Path to the MPEG-2 video file.
+    target_frames: Frame number to check, or a list of frame numbers answered in a single scan.
+    use_index: Answer from (and save) the keyframe index of the file instead of rescanning it.
+    jobs: Number of processes that scan the file in parallel when the index is built.
+    container: video_file is a container (MKV, M2TS...) whose packets are demuxed instead of a raw stream.
+    quiet: Only return the result without printing it.
+    """
+    result = _check_frames(video_file, 'mpeg2', target_frames, verbose and not quiet, use_index, jobs, container)
+    if quiet:
+        return result
+
+    console.print(f"\nExecution time: [blue]{result.elapsed:.3f}[/] seconds")
+    console.print(f"\nMPEG-2 output frame format: (decoding_order, display_order)")
+
+    if len(result.checks) > 1:
+        _print_frame_table(result, "Closed GOP I", show_decode=True)
+    else:
+        target_frame, target_is_safe, safe_before, safe_after = result.checks[0]
+        # report target frame status
+        if target_is_safe:
+            console.print(f"[green]Frame {target_frame} is a closed GOP I-frame[/]")
+        else:
+            console.print(f"[yellow]Frame {target_frame} is not a closed GOP I-frame[/]")
+
+        # nearest safe cut points
+        if safe_before is not None:
+            console.print(f"Nearest closed GOP I-frame before target: [green]{safe_before}[/]")
+        else:
+            console.print("[yellow]No closed GOP I-frame found before the target frame[/]")
+
+        if safe_after is not None:
+            console.print(f"Nearest closed GOP I-frame after target: [green]{safe_after}[/]")
+        else:
+            console.print("[yellow]No closed GOP I-frame found after the target frame[/]")
+
+    if verbose:
+        last = result.checks[-1]
+        console.print(f"All closed GOP I-frames: [green]{_keyframes_through(result.index, last.target, last.after)}[/]")
+    return result
+
+
+def find_safe_frames_vc1(video_file, target_frames, verbose: bool, use_index: bool = True, jobs: int = 1,
+                         container: bool = False, quiet: bool = False) -> ScanResult:
+    """
+    Determines whether the target frame is a closed entry-point (CEP) I-frame.
+    If not, find the nearest bi-directional CEP I-frames. See _scan_vc1 for the bitstream details.
+    video_file: Path to the VC-1 video file.
+    target_frames: Frame number to check (decode order), or a list of frame numbers answered in a single scan.
+    use_index: Answer from (and save) the keyframe index of the file instead of rescanning it.
+    jobs: Number of processes that scan the file in parallel when the index is built.
+    container: video_file is a container (MKV, M2TS...) whose packets are demuxed instead of a raw stream.
+    quiet: Only return the result without printing it.
+    """
+    result = _check_frames(video_file, 'vc1', target_frames, verbose and not quiet, use_index, jobs, container)
+    if quiet:
+        return result
+
+    console.print(f"\nExecution time: [blue]{result.elapsed:.3f}[/] seconds")
+
+    if len(result.checks) > 1:
+        _print_frame_table(result, "CEP I")
+    else:
+        target_frame, target_is_safe, safe_before, safe_after = result.checks[0]
+        if target_is_safe:
+            console.print(f"[green]Frame {target_frame} is a CEP I-frame[/]")
+        else:
+            console.print(f"[yellow]Frame {target_frame} is not a CEP I-frame[/]")
+
+        if safe_before is not None:
+            console.print(f"Nearest CEP I-frame before target: [green]{safe_before[1]}[/]")
+        else:
+            console.print("[yellow]No CEP I-frames found before the target frame[/]")
+
+        if safe_after is not None:
+            console.print(f"Nearest CEP I-frame after target: [green]{safe_after[1]}[/]")
+        else:
+            console.print("[yellow]No CEP I-frames found after the target frame[/]")
+
+    if verbose:
+        last = result.checks[-1]
+        cep_frames = [frame for _, frame in _keyframes_through(result.index, last.target, last.after)]
+        console.print(f"All CEP I-frames: [green]{cep_frames}[/]")
+    return result
+
+
+# scanner codec -> name of its safe cut frames
+KEYFRAME_NAMES = {
+    'h264': 'IDR',
+    'hevc': 'IRAP',
+    'mpeg2': 'Closed GOP I',
+    'vc1': 'CEP I',
+}
+
+# scanner codec -> find_* function reporting on it
+FIND_FUNCTIONS = {
+    'h264': find_idr_frames,
+    'hevc': find_irap_frames,
+    'mpeg2': find_safe_frames_mpeg2,
+    'vc1': find_safe_frames_vc1,
+}
+
+
+def detect_stream(video_file) -> StreamInfo:
+    """
+    Probes video_file with PyAV and works out which scanner handles it.
+    Raises ValueError if the file holds no supported video stream.
+    """
+    with av.open(str(video_file)) as av_file:
+        format_name = av_file.format.name
+        if not av_file.streams.video:
+            raise ValueError(f"No video stream found in {Path(video_file).name}")
+        codec_context = av_file.streams.video[0].codec_context
+        codec = STREAM_CODECS.get(codec_context.name)
+        profile = codec_context.profile
+        frame_rate = av_file.streams.video[0].average_rate
+    if codec is None:
+        raise ValueError(f"Video must be an h264, hevc, mpeg, or vc1 stream, detected: {format_name} {codec_context.name}")
+    if codec == 'vc1' and profile != "Advanced":
+        raise ValueError(f"{profile} format profile VC-1 streams are not supported")
+    # anything that isn't a raw elementary stream is demuxed packet by packet
+    container = format_name not in RAW_STREAM_FORMATS
+    return StreamInfo(codec, container, format_name, codec_context.name, profile,
+                      Fraction(frame_rate) if container and frame_rate else None)
+
+
+def check_frames(video_file, target_frames, use_index: bool = True, jobs: int = 1) -> ScanResult:
+    """
+    Library entry point: detects the stream type of video_file and checks the target frames
+    against it without printing anything.
+    Raises ValueError for unsupported files.
+    """
+    stream_info = detect_stream(video_file)
+    find = FIND_FUNCTIONS[stream_info.codec]
+    return find(str(video_file), target_frames, False, use_index, jobs, stream_info.container, quiet=True)
+
+
+def _copy_range(source, target, offset: int, length: int) -> str:
+    """
+    Appends length bytes of source starting at offset to target, both open binary files.
+    The copy is left to the kernel where it can be: copy_file_range (a reflink or server-side
+    copy on filesystems that support it), then sendfile, then a plain read/write loop.
+    Returns the method that copied the data.
+    """
+    source_fd, target_fd = source.fileno(), target.fileno()
+    copied = 0
+    for method in ('copy_file_range', 'sendfile'):
+        if not hasattr(os, method):
+            continue
+        try:
+            while copied < length:
+                if method == 'copy_file_range':
+                    count = os.copy_file_range(source_fd, target_fd, length - copied, offset + copied)
+                else:
+                    count = os.sendfile(target_fd, source_fd, offset + copied, length - copied)
+                if count == 0:
+                    raise EOFError(f"{source.name} ended {length - copied} bytes early")
+                copied += count
+            return method
+        except OSError as error:
+            # a copy that failed part way is a real I/O error, not a missing feature
+            if copied or error.errno not in KERNEL_COPY_UNSUPPORTED:
+                raise
+    source.seek(offset)
+    while copied < length:
+        chunk = source.read(min(SPLIT_BUFFER_SIZE, length - copied))
+        if not chunk:
+            raise EOFError(f"{source.name} ended {length - copied} bytes early")
+        target.write(chunk)
+        copied += len(chunk)
+    return 'read/write'
+
+
+def split_stream(video_file, index: KeyframeIndex, split_frames, verbose: bool = False) -> List[str]:
+    """
+    Cuts a raw elementary stream in front of each of split_frames (display order), which must be
+    safe cut frames of index, without decoding or rewriting anything: every part is a byte range
+    of video_file copied to <stem>.part<n><suffix> next to it.
+    Returns the paths of the parts written.
+    Raises ValueError if a split frame isn't a safe cut frame or index has no byte offsets
+    (streams demuxed from a container).
+    """
+    video_file = Path(video_file)
+    boundaries = []
+    for frame in _as_frame_list(split_frames):
+        position = bisect.bisect_left(index.display_frames, frame)
+        if position == len(index.display_frames) or index.display_frames[position] != frame:
+            raise ValueError(f"Frame {frame} is not a safe cut frame")
+        offset = index.offsets[position]
+        if offset < 0:
+            raise ValueError(f"{video_file.name} has no byte offsets to split at, only raw elementary streams can be split")
+        if offset == 0:
+            raise ValueError(f"Frame {frame} starts the stream, there is nothing in front of it to split off")
+        boundaries.append(offset)
+    boundaries = [0] + boundaries + [video_file.stat().st_size]
+
+    part_files = []
+    with open(video_file, 'rb') as source:
+        for part, (start, end) in enumerate(zip(boundaries, boundaries[1:]), 1):
+            part_file = video_file.with_name(f"{video_file.stem}.part{part}{video_file.suffix}")
+            with open(part_file, 'wb') as target:
+                method = _copy_range(source, target, start, end - start)
+            if verbose:
+                console.print(f"Wrote bytes {start}-{end - 1} to {part_file.name} ({method})")
+            part_files.append(str(part_file))
+    return part_files
+
+
+def _index_segment(video_file, codec, container: bool, use_index: bool) -> Tuple[KeyframeIndex, ScanStats, bool]:
+    """
+    Worker process entry point of the playlist mode, returns the full keyframe index of one
+    segment, its ScanStats and whether it was read from the segment's index.
+    """
+    if use_index:
+        index = _read_index(video_file, codec)
+        if index is not None:
+            return index, ScanStats(), True
+    index, stats = _scan_stream(video_file, codec, None, None, 1, container)
+    if use_index:
+        _write_index(video_file, index)
+    return index, stats, False
+
+
+def _check_playlist(video_files, streams, target_frames, verbose: bool, use_index: bool, jobs: int) -> PlaylistResult:
+    """
+    Indexes every segment once, the ones without a keyframe index in a pool of `jobs` processes
+    (0 for one per CPU), joins them into one timeline and resolves the target frames against it.
+    """
+    start_time = time.time()
+    target_frames = _as_frame_list(target_frames)
+    codec = streams[0].codec
+
+    segments = [None] * len(video_files)
+    if use_index:
+        for i, video_file in enumerate(video_files):
+            index = _read_index(video_file, codec)
+            if index is not None:
+                segments[i] = (index, ScanStats(), True)
+    # playlists may play the same file more than once, each file is only indexed once
+    pending = {}
+    for i, segment in enumerate(segments):
+        if segment is None:
+            pending.setdefault(Path(video_files[i]).resolve(), []).append(i)
+
+    stats = ScanStats()
+    if pending:
+        workers = min(len(pending), jobs or os.cpu_count() or 1)
+        status_ctx = console.status("Starting scan...", spinner="dots") if verbose else contextlib.nullcontext()
+        try:
+            with status_ctx as status, ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(_index_segment, str(video_files[positions[0]]), codec,
+                                           streams[positions[0]].container, use_index): positions
+                           for positions in pending.values()}
+                for done, future in enumerate(as_completed(futures), 1):
+                    for i in futures[future]:
+                        segments[i] = future.result()
+                    stats = stats.add(segments[i][1])
+                    if status is not None:
+                        status.update(f"Indexed {done}/{len(pending)} segments with {workers} jobs")
+        except FileNotFoundError as e:
+            console.print(f"[red]{e.filename} not found[/]")
+            sys.exit(1)
+        except Exception as e:
+            console.print(f"[red]Error reading segments:[/] {e}")
+            sys.exit(1)
+
+    frame_base = 0
+    frame_bases = []
+    decode_frames = []
+    display_frames = []
+    offsets = []
+    keyframe_segments = []
+    for i, (index, _, _) in enumerate(segments):
+        frame_bases.append(frame_base)
+        decode_frames.extend(frame_base + frame for frame in index.decode_frames)
+        display_frames.extend(frame_base + frame for frame in index.display_frames)
+        offsets.extend(index.offsets)
+        keyframe_segments.extend([i] * len(index.decode_frames))
+        frame_base += index.frame_count
+
+    timeline = KeyframeIndex(codec, frame_base, decode_frames, display_frames, offsets)
+    checks = [FrameCheck(target_frame, *_nearest_keyframes(timeline, target_frame)) for target_frame in target_frames]
+    elapsed = time.time() - start_time
+    return PlaylistResult([str(video_file) for video_file in video_files], codec, frame_bases, checks, timeline,
+                          keyframe_segments, stats.bytes_scanned, elapsed, stats)
+
+
+def find_playlist_frames(video_files, streams, target_frames, verbose: bool, use_index: bool = True,
+                         jobs: int = 0, quiet: bool = False) -> PlaylistResult:
+    """
+    Checks target frames on the timeline of several segments played back to back, e.g. the
+    m2ts files of a seamless branching playlist. Frame numbers count from the first frame of
+    the first segment.
+    video_files: Paths to the segments, in playback order.
+    streams: StreamInfo of every segment, as returned by detect_stream. All segments must share a codec.
+    target_frames: Frame number to check, or a list of frame numbers answered in a single scan.
+    use_index: Answer from (and save) the keyframe index of each segment instead of rescanning it.
+    jobs: Number of segments indexed at the same time, 0 for one per CPU.
+    quiet: Only return the result without printing it.
+    """
+    result = _check_playlist(video_files, streams, target_frames, verbose and not quiet, use_index, jobs)
+    if quiet:
+        return result
+
+    console.print(f"\nExecution time: [blue]{result.elapsed:.3f}[/] seconds")
+
+    table = Table()
+    table.add_column("Segment", justify="right")
+    table.add_column("File")
+    table.add_column("First frame", justify="right")
+    table.add_column("Frames", justify="right")
+    frame_ends = result.frame_bases[1:] + [result.index.frame_count]
+    for i, (video_file, first_frame, frame_end) in enumerate(zip(result.video_files, result.frame_bases, frame_ends)):
+        table.add_row(str(i + 1), Path(video_file).name, str(first_frame), str(frame_end - first_frame))
+    console.print(table)
+
+    show_decode = result.codec == 'mpeg2'
+    if show_decode:
+        console.print("\nMPEG-2 output frame format: (decoding_order, display_order)")
+    _print_frame_table(result, KEYFRAME_NAMES[result.codec], show_decode, playlist=result)
+
+    if verbose:
+        last = result.checks[-1]
+        keyframes = _keyframes_through(result.index, last.target, last.after)
+        if not show_decode:
+            keyframes = [frame for _, frame in keyframes]
+        console.print(f"All {KEYFRAME_NAMES[result.codec]} frames: [green]{keyframes}[/]")
+    return result
+
+
+def check_playlist(video_files, target_frames, use_index: bool = True, jobs: int = 0) -> PlaylistResult:
+    """
+    Library entry point of the playlist mode: detects the stream type of every segment and checks
+    the target frames against the joined timeline without printing anything.
+    Raises ValueError for unsupported files or segments of different codecs.
+    """
+    streams = [detect_stream(video_file) for video_file in video_files]
+    if len({stream.codec for stream in streams}) > 1:
+        raise ValueError("All segments must use the same video codec")
+    return find_playlist_frames(video_files, streams, target_frames, False, use_index, jobs, quiet=True)
+
+
+class IndexCache:
+    """
+    Keyframe indexes of recently queried files, held in memory by --serve. The least recently
+    used one is dropped once more than max_files are held. Files missing from the cache are
+    indexed in a background process pool, reading or writing their keyframe index like any
+    other query, so a restarted server picks the indexes up again without rescanning.
+    """
+    def __init__(self, max_files: int = SERVE_CACHE_SIZE, jobs: int = 0):
+        self.max_files = max_files
+        self._indexes = OrderedDict()   # (path, size, mtime_ns) -> (StreamInfo, KeyframeIndex)
+        self._pending = {}              # (path, size, mtime_ns) -> (StreamInfo, Future) of files being indexed
+        self._lock = threading.Lock()
+        self._executor = ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1)
+
+    @staticmethod
+    def _key(video_file):
+        # a changed file gets a new key, its old index is left to fall out of the cache
+        path = Path(video_file).resolve()
+        stat = os.stat(path)
+        return str(path), stat.st_size, stat.st_mtime_ns
+
+    def submit(self, video_file):
+        """
+        Starts indexing video_file in the background unless it is cached or already being indexed.
+        Raises ValueError if it holds no supported video stream.
+        """
+        key = self._key(video_file)
+        with self._lock:
+            if key in self._indexes or key in self._pending:
+                return key
+        stream_info = detect_stream(key[0])
+        with self._lock:
+            if key in self._indexes or key in self._pending:
+                return key
+            future = self._executor.submit(_index_segment, key[0], stream_info.codec, stream_info.container, True)
+            self._pending[key] = (stream_info, future)
+        # outside the lock, the callback runs right away if the future is already done
+        future.add_done_callback(lambda done: self._finish(key, stream_info, done))
+        return key
+
+    def _finish(self, key, stream_info, future):
+        # moves a file that finished indexing into the cache, a failed one is indexed again on its next query
+        with self._lock:
+            self._pending.pop(key, None)
+            if future.cancelled() or future.exception() is not None:
+                return
+            self._indexes[key] = (stream_info, future.result()[0])
+            while len(self._indexes) > self.max_files:
+                self._indexes.popitem(last=False)
+
+    def get(self, video_file, wait: bool = True):
+        """
+        Returns (StreamInfo, KeyframeIndex, ScanStats, from_index) of video_file, waiting for it
+        to be indexed if needed. Returns None if it is still being indexed and wait is False.
+        """
+        while True:
+            key = self.submit(video_file)
+            with self._lock:
+                if key in self._indexes:
+                    self._indexes.move_to_end(key)
+                    stream_info, index = self._indexes[key]
+                    return stream_info, index, ScanStats(), True
+                pending = self._pending.get(key)
+            # otherwise it was indexed and already dropped again in between, index it again
+            if pending is not None:
+                break
+
+        stream_info, future = pending
+        if not wait and not future.done():
+            return None
+        index, stats, from_index = future.result()
+        return stream_info, index, stats, from_index
+
+    def check(self, video_file, target_frames, wait: bool = True) -> Optional[ScanResult]:
+        """
+        check_frames against the cached index of video_file.
+        Returns None if it is still being indexed and wait is False.
+        """
+        start_time = time.time()
+        target_frames = _as_frame_list(target_frames)
+        cached = self.get(video_file, wait)
+        if cached is None:
+            return None
+        stream_info, index, stats, from_index = cached
+        checks = [FrameCheck(target_frame, *_nearest_keyframes(index, target_frame)) for target_frame in target_frames]
+        return ScanResult(str(video_file), stream_info.codec, checks, index, stats.bytes_scanned,
+                          time.time() - start_time, from_index, stats)
+
+    def status(self):
+        """
+        Files held in the cache, most recently used last, and files being indexed.
+        """
+        with self._lock:
+            return {
+                'cached': [{'file': key[0], 'codec': stream_info.codec, 'frame_count': index.frame_count}
+                           for key, (stream_info, index) in self._indexes.items()],
+                'indexing': [key[0] for key in self._pending],
+            }
+
+    def close(self):
+        try:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        except TypeError:
+            # cancel_futures is new in Python 3.9, queued indexing jobs still run on 3.8
+            self._executor.shutdown(wait=False)
+
+
+def _answer_query(cache: IndexCache, query, root: Path):
+    """
+    Answers one --serve query, a dict with the file to check and its frames:
+        {"file": "video.h264", "frames": [1000, 52000], "wait": true, "keyframes": false}
+    file: relative to root, files outside root are refused.
+    wait: wait for a file that is being indexed instead of answering {"status": "indexing"}.
+    keyframes: include every safe cut frame of the file in the response.
+    Returns (HTTP status code, JSON serializable response).
+    """
+    if not isinstance(query, dict):
+        return 400, {'error': "Query must be a JSON object"}
+    video_file = query.get('file')
+    frames = query.get('frames', query.get('frame'))
+    if isinstance(frames, int):
+        frames = [frames]
+    if not isinstance(video_file, str) or not isinstance(frames, list) or not frames:
+        return 400, {'error': "Query needs a file and at least one frame"}
+    if any(not isinstance(frame, int) or isinstance(frame, bool) or frame < 0 for frame in frames):
+        return 400, {'error': "Frame numbers must be non-negative integers"}
+    # resolved first, so neither .. nor a symlink leads out of root
+    path = (root / video_file).resolve()
+    try:
+        path.relative_to(root)
+    except ValueError:
+        return 403, {'error': f"{video_file} is outside {root}"}
+
+    try:
+        result = cache.check(str(path), frames, bool(query.get('wait', True)))
     except FileNotFoundError:
-        console.print(f"[red]{video_file} not found[/]")
-        sys.exit(1)
+        return 404, {'error': f"{video_file} not found"}
+    except ValueError as ve:
+        return 400, {'error': str(ve)}
     except Exception as e:
-        console.print(f"[red]Error reading {video_file}:[/] {e}")
+        return 500, {'error': f"Error reading {video_file}: {e}"}
+    if result is None:
+        return 202, {'file': video_file, 'status': 'indexing'}
+    return 200, result.to_dict(bool(query.get('keyframes', False)))
+
+
+class _SocketQueryHandler(socketserver.StreamRequestHandler):
+    """
+    Unix socket connection of --serve: one JSON query per line in, one JSON response per line out.
+    """
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                _, response = _answer_query(self.server.cache, json.loads(line), self.server.root)
+            except ValueError as ve:
+                response = {'error': f"Invalid JSON: {ve}"}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class _HTTPQueryHandler(BaseHTTPRequestHandler):
+    """
+    Localhost HTTP interface of --serve.
+        GET  /check?file=video.h264&frame=1000&frame=52000[&wait=0][&keyframes=1]
+        POST /check with a JSON query as the body
+        GET  /status
+    Requests a web page makes the browser send are refused, so no site can start scans.
+    """
+    def _foreign_request(self):
+        """
+        Why the request doesn't come from a local client, or None if it does: the Host must be a
+        loopback name (a rebound DNS name isn't), and browsers add an Origin or Sec-Fetch-Site
+        header to requests made by a web page.
+        """
+        host = urlsplit(f"//{self.headers.get('Host', '')}").hostname
+        if host not in LOOPBACK_HOSTS:
+            return f"Host {host} is not a loopback address"
+        origin = self.headers.get('Origin')
+        if origin is not None and urlsplit(origin).hostname not in LOOPBACK_HOSTS:
+            return f"Cross-origin request from {origin}"
+        if self.headers.get('Sec-Fetch-Site', 'none') not in ('none', 'same-origin'):
+            return "Cross-site request"
+        return None
+
+    def _reply(self, code, response):
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        reason = self._foreign_request()
+        if reason is not None:
+            self._reply(403, {'error': reason})
+            return
+        url = urlsplit(self.path)
+        if url.path == '/status':
+            self._reply(200, self.server.cache.status())
+            return
+        if url.path != '/check':
+            self._reply(404, {'error': f"Unknown path {url.path}"})
+            return
+        params = parse_qs(url.query)
+        try:
+            frames = [int(frame) for frame in params.get('frame', [])]
+        except ValueError:
+            self._reply(400, {'error': "Frame numbers must be non-negative integers"})
+            return
+        query = {'file': params.get('file', [None])[0], 'frames': frames,
+                 'wait': params.get('wait', ['1'])[0] not in ('0', 'false'),
+                 'keyframes': params.get('keyframes', ['0'])[0] not in ('0', 'false')}
+        self._reply(*_answer_query(self.server.cache, query, self.server.root))
+
+    def do_POST(self):
+        reason = self._foreign_request()
+        if reason is not None:
+            self._reply(403, {'error': reason})
+            return
+        if urlsplit(self.path).path != '/check':
+            self._reply(404, {'error': f"Unknown path {self.path}"})
+            return
+        try:
+            query = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError as ve:
+            self._reply(400, {'error': f"Invalid JSON: {ve}"})
+            return
+        self._reply(*_answer_query(self.server.cache, query, self.server.root))
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            console.print(f"{self.address_string()} {format % args}")
+
+
+def serve(socket_path=None, port: int = SERVE_PORT, max_files: int = SERVE_CACHE_SIZE, jobs: int = 0,
+          preload=(), verbose: bool = False, root=None):
+    """
+    Runs the keyframe index server until interrupted, answering queries over a Unix socket at
+    socket_path, or over HTTP on localhost:port without one.
+    max_files: Number of keyframe indexes held in memory.
+    jobs: Number of files indexed at the same time, 0 for one per CPU.
+    preload: Files to start indexing right away.
+    root: Only files under this folder are answered, the current folder if None.
+    """
+    root = Path(root or os.getcwd()).resolve()
+    if not root.is_dir():
+        console.print(f"[red]{root} is not a folder[/]")
         sys.exit(1)
- 
-    end_time = time.time()
-    console.print(f"\nExecution time: [blue]{end_time - start_time:.3f}[/] seconds")
- 
-    if target_is_safe:
-        console.print(f"[green]Frame {target_frame} is a CEP I-frame[/]")
-    else:
-        console.print(f"[yellow]Frame {target_frame} is not a CEP I-frame[/]")
- 
-    if safe_before is not None:
-        console.print(f"Nearest CEP I-frame before target: [green]{safe_before}[/]")
+    cache = IndexCache(max_files, jobs)
+    for video_file in preload:
+        try:
+            cache.submit(video_file)
+        except (OSError, ValueError) as e:
+            console.print(f"[yellow]Not preloading {video_file}:[/] {e}")
+
+    if socket_path is not None:
+        if not hasattr(socketserver, 'ThreadingUnixStreamServer'):
+            console.print("[red]Unix sockets are not available on this platform, serve over HTTP with --port[/]")
+            sys.exit(1)
+        if Path(socket_path).is_socket():
+            os.unlink(socket_path)
+        server = socketserver.ThreadingUnixStreamServer(socket_path, _SocketQueryHandler)
+        address = socket_path
     else:
-        console.print("[yellow]No CEP I-frames found before the target frame[/]")
- 
-    if safe_after is not None:
-        console.print(f"Nearest CEP I-frame after target: [green]{safe_after}[/]")
+        server = ThreadingHTTPServer(('127.0.0.1', port), _HTTPQueryHandler)
+        address = f"http://127.0.0.1:{server.server_address[1]}"
+    server.daemon_threads = True
+    server.cache = cache
+    server.root = root
+    server.verbose = verbose
+
+    console.print(f"[green]Serving keyframe queries on[/] {address} [green]for files under[/] {root}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        cache.close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def _profile_report(result, jobs: int, profiler: Optional[cProfile.Profile] = None):
+    """
+    JSON serializable --profile report of a ScanResult or PlaylistResult: the throughput of the
+    scan, and the functions that took the most time if the query ran under cProfile.
+    """
+    report = {
+        'files': result.video_files if isinstance(result, PlaylistResult) else [result.video_file],
+        'codec': result.codec,
+        'jobs': jobs,
+        'elapsed': round(result.elapsed, 6),
+        'scan': result.stats.to_dict(),
+    }
+    if profiler is not None:
+        # (file, line, function) -> (primitive calls, calls, own time, cumulative time, callers)
+        rows = sorted(pstats.Stats(profiler).stats.items(), key=lambda row: row[1][3], reverse=True)
+        report['cprofile'] = [
+            {'function': f"{Path(file).name}:{line}({function})", 'calls': calls,
+             'tottime': round(own_time, 6), 'cumtime': round(cumulative_time, 6)}
+            for (file, line, function), (_, calls, own_time, cumulative_time, _) in rows[:PROFILE_TOP_FUNCTIONS]
+        ]
+    return report
+
+
+def _read_frames_file(frames_file):
+    """
+    Reads frame numbers from a text file, separated by newlines, commas or whitespace.
+    Anything after a # on a line is ignored.
+    """
+    frames = []
+    with open(frames_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            for value in re.split(r'[\s,]+', line.split('#', 1)[0]):
+                if value:
+                    frames.append(int(value))
+    return frames
+
+
+def _parse_timestamp(timestamp: str) -> Fraction:
+    """
+    Converts an HH:MM:SS.nnn, MM:SS.nnn or SS.nnn timestamp to exact seconds.
+    """
+    parts = timestamp.strip().split(':')
+    if len(parts) > 3 or not all(re.fullmatch(r'\d+', part) for part in parts[:-1]) \
+            or not re.fullmatch(r'\d+(?:\.\d+)?', parts[-1]):
+        raise ValueError(f"Invalid timestamp: {timestamp!r}")
+    seconds = Fraction(0)
+    for part in parts:
+        seconds = seconds * 60 + Fraction(part)
+    return seconds
+
+
+def _format_timestamp(seconds: Fraction, digits: int) -> str:
+    """
+    Formats seconds as HH:MM:SS with digits decimals.
+    """
+    units = round(seconds * 10 ** digits)
+    whole, fraction = divmod(units, 10 ** digits)
+    minutes, secs = divmod(whole, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02}:{minutes:02}:{secs:02}" + (f".{fraction:0{digits}}" if digits else "")
+
+
+def _timestamp_digits(timestamp: str) -> int:
+    """
+    Decimals to write a snapped timestamp with: as many as the original, and at least milliseconds.
+    """
+    _, _, fraction = timestamp.strip().partition('.')
+    return max(3, len(fraction))
+
+
+def frame_rate(value: str) -> Fraction:
+    """
+    argparse type of --fps: 24000/1001, 25 or a decimal rate, with the NTSC shorthands made exact.
+    """
+    try:
+        rate = NTSC_FRAME_RATES.get(value.strip()) or Fraction(value.strip())
+    except (ValueError, ZeroDivisionError):
+        raise argparse.ArgumentTypeError(f"invalid frame rate: {value!r}")
+    if rate <= 0:
+        raise argparse.ArgumentTypeError(f"frame rate must be positive: {value!r}")
+    return rate
+
+
+def _chapter_time_elements(tree):
+    """
+    The ChapterTimeStart/ChapterTimeEnd elements of a Matroska chapters XML, in document order.
+    """
+    return [element for element in tree.iter() if element.tag in CHAPTER_TIME_TAGS]
+
+
+def _read_chapters(chapters_file) -> ChapterFile:
+    """
+    Reads a Matroska chapters XML, or a text file with one timestamp per line (optionally followed
+    by the chapter name, or as OGM CHAPTER01=00:00:00.000 lines).
+    Raises ValueError if the file holds no timestamps, ET.ParseError if the XML is malformed.
+    """
+    with open(chapters_file, 'r', encoding='utf-8-sig') as f:
+        text = f.read()
+    tree = None
+    prolog = ''
+    lines = []
+    timestamps = []
+    starts = []
+    if text.lstrip().startswith('<'):
+        # keep comments inside the chapters, they are written back out
+        parser = ET.XMLParser(target=ET.TreeBuilder(insert_comments=True))
+        tree = ET.ElementTree(ET.fromstring(text, parser))
+        # ElementTree drops everything in front of the root element, it is written back as read
+        prolog = XML_PROLOG.match(text).group(0)
+        elements = _chapter_time_elements(tree)
+        timestamps = [element.text or '' for element in elements]
+        starts = [element.tag == CHAPTER_TIME_TAGS[0] for element in elements]
     else:
-        console.print("[yellow]No CEP I-frames found after the target frame[/]")
- 
-    if verbose:
-        console.print(f"All CEP I-frames: [green]{sorted(safe_cut_frames)}[/]")
+        lines = text.splitlines()
+        for line in lines:
+            match = CHAPTER_LINE.match(line)
+            if match:
+                timestamps.append(match.group(2))
+                starts.append(True)
+    if not timestamps:
+        raise ValueError(f"No chapter timestamps found in {chapters_file}")
+    return ChapterFile(str(chapters_file), tree, lines, [_parse_timestamp(timestamp) for timestamp in timestamps],
+                       [_timestamp_digits(timestamp) for timestamp in timestamps], prolog, starts)
+
+
+def _write_chapters(chapters: ChapterFile, times, out_file):
+    """
+    Writes chapters back out to out_file in its original format, with times (seconds, None to keep
+    the original timestamp) replacing its timestamps in file order.
+    """
+    replacements = [None if seconds is None else _format_timestamp(seconds, digits)
+                    for seconds, digits in zip(times, chapters.digits)]
+    if chapters.tree is not None:
+        for element, replacement in zip(_chapter_time_elements(chapters.tree), replacements):
+            if replacement is not None:
+                element.text = replacement
+        with open(out_file, 'wb') as f:
+            if chapters.prolog:
+                f.write(chapters.prolog.encode('utf-8'))
+            chapters.tree.write(f, encoding='utf-8', xml_declaration=not chapters.prolog)
+            f.write(b'\n')
+        return
+    replacements = iter(replacements)
+    lines = []
+    for line in chapters.lines:
+        match = CHAPTER_LINE.match(line)
+        if match:
+            replacement = next(replacements)
+            if replacement is not None:
+                line = match.group(1) + replacement + (match.group(3) or '')
+        lines.append(line)
+    with open(out_file, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def _snap_frame(check: FrameCheck) -> int:
+    """
+    The safe cut frame (display order) nearest to check.target, the earlier one on a tie.
+    Targets that are safe, or have no safe frame on either side, are kept.
+    """
+    if check.is_safe:
+        return check.target
+    candidates = [keyframe[1] for keyframe in (check.before, check.after) if keyframe is not None]
+    if not candidates:
+        return check.target
+    return min(candidates, key=lambda frame: (abs(frame - check.target), frame))
+
+
+def snap_chapters(chapters: ChapterFile, result, fps: Fraction):
+    """
+    Moves every chapter timestamp onto the nearest safe cut frame found by result, which must have
+    checked the chapter frames round(time * fps).
+    Returns one dict per timestamp, in file order, with its original and snapped frame and time, and
+    warnings for chapters moved by more than CHAPTER_SHIFT_WARNING seconds and chapter starts snapped
+    onto the same frame as an earlier one.
+    """
+    checks = {check.target: check for check in result.checks}
+    snapped = []
+    for chapter_time in chapters.times:
+        frame = round(chapter_time * fps)
+        snapped_frame = _snap_frame(checks[frame])
+        snapped.append({
+            'time': chapter_time,
+            'frame': frame,
+            'is_safe': checks[frame].is_safe,
+            'snapped_frame': snapped_frame,
+            # timestamps already on a safe frame are left as they were written
+            'snapped_time': chapter_time if snapped_frame == frame else Fraction(snapped_frame) / fps,
+            'warnings': [],
+        })
+
+    first_start = {}
+    starts = chapters.starts or [True] * len(snapped)
+    for number, (chapter, is_start) in enumerate(zip(snapped, starts), 1):
+        shift = float(chapter['snapped_time'] - chapter['time'])
+        if abs(shift) > CHAPTER_SHIFT_WARNING:
+            chapter['warnings'].append(f"moved {shift:+.3f}s to frame {chapter['snapped_frame']}")
+        if is_start:
+            earlier = first_start.setdefault(chapter['snapped_frame'], number)
+            if earlier != number:
+                chapter['warnings'].append(f"starts on the same frame as chapter {earlier}")
+    return snapped
+
+
+def _print_chapter_table(snapped, label):
+    """
+    Prints one row per chapter timestamp with the frame it was moved to.
+    """
+    table = Table()
+    table.add_column("Chapter", justify="right")
+    table.add_column("Time")
+    table.add_column("Frame", justify="right")
+    table.add_column(label)
+    table.add_column("Snapped frame", justify="right")
+    table.add_column("Snapped time")
+    table.add_column("Shift", justify="right")
+    for number, chapter in enumerate(snapped, 1):
+        shift = chapter['snapped_frame'] - chapter['frame']
+        table.add_row(str(number), _format_timestamp(chapter['time'], 3), str(chapter['frame']),
+                      "[green]yes[/]" if chapter['is_safe'] else "[yellow]no[/]",
+                      f"[green]{chapter['snapped_frame']}[/]", _format_timestamp(chapter['snapped_time'], 3),
+                      f"{shift:+d}" if shift else "0")
+    console.print(table)
 
 
 def main():
     parser = argparse.ArgumentParser(
-        description='Check if a frame is an IDR frame in an H.264 stream, a closed GOP I-frame in an MPEG-2 stream, or a closed entry-point I-frame in a VC-1 stream.',
+        description='Check if a frame is an IDR frame in an H.264 stream, an IRAP frame in an HEVC stream, a closed GOP I-frame in an MPEG-2 stream, or a closed entry-point I-frame in a VC-1 stream.',
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog='''
             Usage:
             check_idr.py video.h264 --frame 1000
+            check_idr.py video.hevc -f 1000
             check_idr.py video.m2v -f 1000 --verbose
             check_idr.py video.vc1 -f 1000 -v
+            check_idr.py video.h264 -f 1000 -f 52000 -f 130500
+            check_idr.py video.h264 --frames-file cuts.txt
+            check_idr.py video.h264 -f 1000 --no-index
+            check_idr.py video.hevc -f 1000 --jobs 8
+            check_idr.py remux.mkv -f 1000
+            check_idr.py video.h264 -f 1000 --json
+            check_idr.py 00055.m2ts 00056.m2ts 00058.m2ts -f 150000
+            check_idr.py --serve
+            check_idr.py --serve --socket /tmp/check_idr.sock video.h264 video.hevc
+            check_idr.py --serve --root /mnt/remuxes
+            check_idr.py video.h264 -f 1000 --no-index --profile scan.json --cprofile scan.prof
+            check_idr.py remux.mkv --chapters chapters.xml
+            check_idr.py video.h264 --chapters chapters.txt --fps 24000/1001 --chapters-out snapped.txt
+            check_idr.py video.h264 --split-at 52000 --split-at 130500
         '''
     )
-    parser.add_argument('video_file', help='Path to the raw stream video file')
-    parser.add_argument('-f', '--frame', type=int, required=True,
-                        help='Frame number to check')
+    parser.add_argument('video_files', nargs='*', metavar='video_file',
+                        help='Path to the raw stream video file, or an MKV/M2TS/MP4 container. '
+                             'Several files are checked as segments of one timeline, in the order given. '
+                             'With --serve, files to start indexing right away')
+    parser.add_argument('-f', '--frame', type=int, action='append', default=[],
+                        help='Frame number to check, can be given multiple times')
+    parser.add_argument('--frames-file',
+                        help='Text file with frame numbers to check, one per line')
+    parser.add_argument('--chapters', metavar='FILE',
+                        help='Matroska chapters XML or a text file of timestamps, every chapter is checked and '
+                             'a copy snapped to the nearest safe cut frames is written')
+    parser.add_argument('--fps', type=frame_rate,
+                        help='Frame rate used to convert --chapters timestamps to frames, e.g. 24000/1001 '
+                             '(default: the frame rate of the container, required for raw streams)')
+    parser.add_argument('--chapters-out', metavar='FILE',
+                        help='Where to write the snapped chapters (default: <chapters>.snapped.<ext>)')
+    parser.add_argument('--split-at', metavar='FRAME', type=int, action='append', default=[],
+                        help='Split a raw stream in front of this safe cut frame into <video>.part1, <video>.part2, ..., '
+                             'can be given multiple times')
     parser.add_argument('-v', '--verbose', action='store_true',
-                        help='console.prints a list of all IDR/closed GOP/closed entry-point frames from 0 -> --frame')
-    
+                        help='console.prints a list of all IDR/IRAP/closed GOP/closed entry-point frames from 0 -> --frame')
+    parser.add_argument('--no-index', action='store_true',
+                        help='Do not read or write the keyframe index, only scan the stream up to the first safe frame after the last --frame. '
+                             'H.264 scans still read and extend the small resumable frame map (<video>.kfmap)')
+    parser.add_argument('--inspect-window', type=int, default=H264_INSPECT_WINDOW,
+                        help='With --no-index, H.264 frames are only counted until this many frames before the last --frame '
+                             f'(default: {H264_INSPECT_WINDOW})')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Number of processes used to scan the stream when building the keyframe index (default: 1), '
+                             'or the number of segments indexed at the same time (default: one per CPU)')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the result as JSON, including every safe cut frame found')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='Write scan throughput (bytes, MB/s, frames/s, start codes inspected, parse and wait time) to FILE as JSON')
+    parser.add_argument('--cprofile', metavar='FILE',
+                        help='Run the query under cProfile and save the stats to FILE, worker processes of --jobs are not profiled')
+    parser.add_argument('--serve', action='store_true',
+                        help='Keep keyframe indexes in memory and answer queries over localhost HTTP or a Unix socket')
+    parser.add_argument('--port', type=int, default=SERVE_PORT,
+                        help=f'Localhost HTTP port of --serve (default: {SERVE_PORT})')
+    parser.add_argument('--socket',
+                        help='Serve queries on this Unix socket instead of HTTP')
+    parser.add_argument('--cache-size', type=int, default=SERVE_CACHE_SIZE,
+                        help=f'Number of keyframe indexes --serve holds in memory (default: {SERVE_CACHE_SIZE})')
+    parser.add_argument('--root', metavar='DIR',
+                        help='Only answer --serve queries for files under this folder, '
+                             'relative paths are resolved against it (default: the current folder)')
+
     args = parser.parse_args()
-    
-    video_file = Path(args.video_file)
-    av_file = av.open(Path(video_file))
-    stream_type = av_file.format.name
-    stream = av_file.streams[0]
-    profile = stream.codec_context.profile
-    if stream_type not in ("h264", "mpegvideo", "vc1"):
-        console.print(f"[yellow]Video file must be a raw h264, mpeg, or vc1 stream.[/yellow]")
-        console.print(f"[yellow]Detected file format:[/yellow] {stream_type}")
+
+    if args.serve:
+        if (args.jobs is not None and args.jobs < 1) or args.cache_size < 1:
+            console.print("[red]--jobs and --cache-size must be at least 1[/]")
+            sys.exit(1)
+        # 0 lets the pool use one process per CPU
+        serve(args.socket, args.port, args.cache_size, args.jobs or 0,
+              args.video_files, args.verbose, args.root)
         return
-    console.print(f"[green]{video_file.name} detected as:[/] {stream_type} {profile}")
-        
-    try:
-        frame = int(args.frame)
-    except ValueError as ve:
-        console.print(f"[red]Frame number must be an integer[/]\n{ve}")
+    if not args.video_files:
+        parser.error("at least one video_file is required")
+
+    frames = list(args.frame)
+    if args.frames_file:
+        try:
+            frames += _read_frames_file(args.frames_file)
+        except FileNotFoundError:
+            console.print(f"[red]{args.frames_file} not found[/]")
+            sys.exit(1)
+        except ValueError as ve:
+            console.print(f"[red]Frame numbers must be integers[/]\n{ve}")
+            sys.exit(1)
+    chapters = None
+    if args.chapters:
+        try:
+            chapters = _read_chapters(args.chapters)
+        except FileNotFoundError:
+            console.print(f"[red]{args.chapters} not found[/]")
+            sys.exit(1)
+        except (ValueError, ET.ParseError) as error:
+            console.print(f"[red]Could not read chapters from {args.chapters}[/]\n{error}")
+            sys.exit(1)
+    frames += args.split_at
+    if not frames and chapters is None:
+        parser.error("at least one --frame, a --frames-file, --chapters or --split-at is required")
+    if any(frame < 0 for frame in frames):
+        console.print("[red]Frame numbers must be non-negative[/]")
+        sys.exit(1)
+    if args.jobs is not None and args.jobs < 1:
+        console.print("[red]--jobs must be at least 1[/]")
         sys.exit(1)
-    verbose = args.verbose
-    
-    if frame < 0:
-        console.print("[red]Frame number must be non-negative[/]")
+    if args.inspect_window < 0:
+        console.print("[red]--inspect-window must be non-negative[/]")
         sys.exit(1)
-    if stream_type == "h264":
-        find_idr_frames(str(video_file), frame, verbose)
-    elif stream_type == "mpegvideo":
-        find_safe_frames_mpeg2(str(video_file), frame, verbose)
-    elif stream_type == "vc1":
-        
-        if profile != "Advanced":
-            console.print(f"{profile} [yellow]format profile VC-1 streams are not supported[/]")
+
+    if args.json:
+        # keep stdout clean for the JSON document, errors and progress go to stderr
+        console.stderr = True
+
+    video_files = [Path(video_file) for video_file in args.video_files]
+    streams = []
+    for video_file in video_files:
+        try:
+            stream_info = detect_stream(video_file)
+        except ValueError as ve:
+            console.print(f"[yellow]{ve}[/yellow]")
             return
+        if stream_info.container:
+            console.print(f"[green]{video_file.name} detected as:[/] {stream_info.format_name} container, "
+                          f"{stream_info.codec_name} {stream_info.profile}")
+        else:
+            console.print(f"[green]{video_file.name} detected as:[/] {stream_info.format_name} {stream_info.profile}")
+        streams.append(stream_info)
+    if len({stream.codec for stream in streams}) > 1:
+        console.print("[yellow]All segments must use the same video codec[/]")
+        return
+    if streams[0].codec == "vc1" and not all(stream.container for stream in streams) and not args.json:
         console.print("Note that frame numbers outputted for VC-1 streams are in [i]decoded[/i] order, " +
                       "which may not match the [i]display[/i] order.")
-        find_safe_frames_vc1(str(video_file), frame, verbose)
+    if args.split_at and (len(video_files) > 1 or streams[0].container):
+        console.print("[red]--split-at only splits a single raw elementary stream, "
+                      "the keyframe index of a container has no byte offsets to split at[/]")
+        sys.exit(1)
+    if chapters is not None:
+        fps = args.fps or streams[0].frame_rate
+        if fps is None:
+            console.print("[red]--fps is required to convert chapter timestamps to frames of a raw stream[/]")
+            sys.exit(1)
+        # every chapter is resolved by the same scan as the --frame targets
+        frames += [round(chapter_time * fps) for chapter_time in chapters.times]
+
+    profiler = cProfile.Profile() if args.cprofile else None
+    if profiler is not None:
+        profiler.enable()
+    if len(video_files) > 1:
+        # segments are indexed one per CPU unless --jobs is given
+        jobs = args.jobs or 0
+        result = find_playlist_frames([str(video_file) for video_file in video_files], streams, frames,
+                                      args.verbose, not args.no_index, jobs, quiet=args.json)
+    else:
+        # a single stream is scanned by one process unless --jobs is given
+        jobs = args.jobs or 1
+        stream_info = streams[0]
+        find = FIND_FUNCTIONS[stream_info.codec]
+        options = {'inspect_window': args.inspect_window} if stream_info.codec == 'h264' else {}
+        result = find(str(video_files[0]), frames, args.verbose, not args.no_index, jobs,
+                      stream_info.container, quiet=args.json, **options)
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
+
+    if args.profile:
+        with open(args.profile, 'w') as f:
+            json.dump(_profile_report(result, jobs, profiler), f, indent=2)
+    output = result.to_dict() if args.json else None
+    if chapters is not None:
+        snapped = snap_chapters(chapters, result, fps)
+        chapters_out = args.chapters_out or Path(chapters.path).with_suffix('.snapped' + Path(chapters.path).suffix)
+        _write_chapters(chapters, [None if chapter['snapped_frame'] == chapter['frame'] else chapter['snapped_time']
+                                   for chapter in snapped], chapters_out)
+        if args.json:
+            output['chapters'] = [dict(chapter, time=float(chapter['time']), snapped_time=float(chapter['snapped_time']))
+                                  for chapter in snapped]
+            output['chapters_out'] = str(chapters_out)
+        else:
+            _print_chapter_table(snapped, KEYFRAME_NAMES[result.codec])
+            for number, chapter in enumerate(snapped, 1):
+                for warning in chapter['warnings']:
+                    console.print(f"[yellow]Chapter {number} {warning}[/]")
+            console.print(f"Snapped chapters written to [green]{chapters_out}[/]")
+    if args.split_at:
+        try:
+            part_files = split_stream(video_files[0], result.index, args.split_at, args.verbose)
+        except ValueError as ve:
+            console.print(f"[red]{ve}[/]")
+            sys.exit(1)
+        if args.json:
+            output['parts'] = part_files
+        else:
+            console.print(f"Split into: [green]{', '.join(Path(part_file).name for part_file in part_files)}[/]")
+    if args.json:
+        print(json.dumps(output, indent=2))
 
 if __name__ == "__main__":
     main()